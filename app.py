@@ -1,18 +1,32 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, g, has_app_context, has_request_context
 import os
 import sqlite3
 import json
+import logging
 import requests
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import tempfile
 import re
+import bisect
+import click
+import contextvars
+import hashlib
+import math
+import random
+import secrets
+import threading
+import time
+import urllib.parse
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from functools import wraps
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
-app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', tempfile.gettempdir())
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['ALLOWED_EXTENSIONS'] = {'sql'}
 
@@ -21,35 +35,205 @@ OLLAMA_API_URL = os.environ.get('OLLAMA_API_URL', 'http://localhost:11434/api/ch
 # Default model - using llama3.2:3b for lower memory requirements (~2GB)
 # For full models (requires 4.6GB+), use: 'llama3', 'llama3:latest'
 OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'llama3.2:3b')
+# Keep-alive connection pool shared by all requests to Ollama
+OLLAMA_POOL_SIZE = int(os.environ.get('OLLAMA_POOL_SIZE', 10))
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get('OLLAMA_CONNECT_TIMEOUT', 5))
+OLLAMA_READ_TIMEOUT = float(os.environ.get('OLLAMA_READ_TIMEOUT', 300))
+# Concurrent generations sent to Ollama, requests allowed to queue behind them,
+# and how long (seconds) a queued request waits before giving up
+OLLAMA_MAX_CONCURRENCY = int(os.environ.get('OLLAMA_MAX_CONCURRENCY', 2))
+OLLAMA_MAX_QUEUE = int(os.environ.get('OLLAMA_MAX_QUEUE', 20))
+OLLAMA_QUEUE_TIMEOUT = float(os.environ.get('OLLAMA_QUEUE_TIMEOUT', 120))
+# How long the cached list of installed models is used before a background refresh
+OLLAMA_MODELS_TTL = float(os.environ.get('OLLAMA_MODELS_TTL', 60))
+# Cache of generated SQL: size, entry lifetime (seconds), near-duplicate similarity
+# threshold (0 disables, e.g. 0.9 enables) and optional SQLite file to persist it
+GENERATION_CACHE_SIZE = int(os.environ.get('GENERATION_CACHE_SIZE', 1000))
+GENERATION_CACHE_TTL = float(os.environ.get('GENERATION_CACHE_TTL', 24 * 60 * 60))
+GENERATION_CACHE_SIMILARITY = float(os.environ.get('GENERATION_CACHE_SIMILARITY', 0))
+GENERATION_CACHE_PATH = os.environ.get('GENERATION_CACHE_PATH') or None
+# Batch generation: parallel questions per batch and maximum batch size
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 4))
+BATCH_MAX_QUERIES = int(os.environ.get('BATCH_MAX_QUERIES', 1000))
+# Multi-candidate generation: most candidates per request, and the time limit (seconds)
+# of the dry run that validates each one
+GENERATION_MAX_CANDIDATES = int(os.environ.get('GENERATION_MAX_CANDIDATES', 4))
+GENERATION_DRY_RUN_TIMEOUT = float(os.environ.get('GENERATION_DRY_RUN_TIMEOUT', 2))
+# Prompt size: approximate token budget and table count for the schema part of the prompt
+PROMPT_SCHEMA_TOKENS = int(os.environ.get('PROMPT_SCHEMA_TOKENS', 600))
+PROMPT_MAX_TABLES = int(os.environ.get('PROMPT_MAX_TABLES', 8))
+SCHEMA_CATALOG_CACHE_SIZE = 64
+
+# Memory budget for cached materialized schema databases (LRU-evicted)
+SCHEMA_CACHE_MAX_BYTES = int(os.environ.get('SCHEMA_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+# Load uploaded schemas in one tuned transaction with batched INSERTs (set to 0 to disable)
+SCHEMA_BULK_LOAD = os.environ.get('SCHEMA_BULK_LOAD', '1') != '0'
+SCHEMA_INSERT_BATCH_BYTES = int(os.environ.get('SCHEMA_INSERT_BATCH_BYTES', 1024 * 1024))
+# Query results: maximum rows returned, rows per streamed chunk, and open pagination cursors
+# (count, idle seconds, and memory for the database copies they keep open)
+EXECUTE_MAX_ROWS = int(os.environ.get('EXECUTE_MAX_ROWS', 10000))
+EXECUTE_STREAM_CHUNK_ROWS = 500
+RESULT_CURSORS_MAX_OPEN = int(os.environ.get('RESULT_CURSORS_MAX_OPEN', 32))
+RESULT_CURSORS_TTL = float(os.environ.get('RESULT_CURSORS_TTL', 300))
+RESULT_CURSORS_MAX_BYTES = int(os.environ.get('RESULT_CURSORS_MAX_BYTES', 64 * 1024 * 1024))
+# Per-query limits: wall-clock seconds, SQLite VM instructions, and memory for the query's database copy
+EXECUTE_TIMEOUT = float(os.environ.get('EXECUTE_TIMEOUT', 10))
+EXECUTE_MAX_INSTRUCTIONS = int(os.environ.get('EXECUTE_MAX_INSTRUCTIONS', 1000000000))
+EXECUTE_MAX_MEMORY_BYTES = int(os.environ.get('EXECUTE_MAX_MEMORY_BYTES', 64 * 1024 * 1024))
+QUERY_PROGRESS_INTERVAL = 10000
+# Pre-flight EXPLAIN QUERY PLAN analysis of generated SQL: on/off, table size that makes a
+# full scan worth a warning, and whether to create suggested indexes on the cached schema
+EXPLAIN_ENABLED = os.environ.get('EXPLAIN_ENABLED', '1') != '0'
+EXPLAIN_LARGE_TABLE_ROWS = int(os.environ.get('EXPLAIN_LARGE_TABLE_ROWS', 10000))
+EXPLAIN_AUTO_INDEX = os.environ.get('EXPLAIN_AUTO_INDEX', '0') == '1'
+EXPLAIN_DEFAULT_ROWS = 1000  # assumed size of CTEs and subqueries
+# Per-schema statement cache: entries kept, and largest read-only result kept with them (0 disables)
+STATEMENT_CACHE_SIZE = int(os.environ.get('STATEMENT_CACHE_SIZE', 512))
+STATEMENT_RESULT_MAX_ROWS = int(os.environ.get('STATEMENT_RESULT_MAX_ROWS', 1000))
+# Uploaded schema workspaces: directory for their SQLite files, bytes of each file to memory-map,
+# and workspaces each user may keep
+WORKSPACE_FOLDER = os.environ.get('WORKSPACE_FOLDER') or os.path.join(app.config['UPLOAD_FOLDER'], 'workspaces')
+WORKSPACE_MMAP_SIZE = int(os.environ.get('WORKSPACE_MMAP_SIZE', 256 * 1024 * 1024))
+WORKSPACE_MAX_PER_USER = int(os.environ.get('WORKSPACE_MAX_PER_USER', 20))
+# User database: connections kept open, password hash method (its cost), and threads hashing at once
+USER_DB_POOL_SIZE = int(os.environ.get('USER_DB_POOL_SIZE', 8))
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+AUTH_WORKERS = int(os.environ.get('AUTH_WORKERS', 4))
+# Startup warm-up, run in the background so the server takes traffic at once: load OLLAMA_MODEL
+# into Ollama's memory and materialize these schema files (separated by os.pathsep) into the
+# schema cache. OLLAMA_KEEP_ALIVE is how long Ollama keeps the model loaded after a request
+# (e.g. '30m', or -1 for ever; unset uses Ollama's default of 5 minutes).
+WARMUP_ENABLED = os.environ.get('WARMUP_ENABLED', '1') != '0'
+WARMUP_SCHEMAS = [path for path in os.environ.get(
+    'WARMUP_SCHEMAS', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_schema.sql')).split(os.pathsep) if path]
+WARMUP_RETRY_INTERVAL = 30  # seconds before a readiness check retries a failed warm-up task
+OLLAMA_KEEP_ALIVE = os.environ.get('OLLAMA_KEEP_ALIVE') or None
+if OLLAMA_KEEP_ALIVE is not None and re.fullmatch(r'-?\d+', OLLAMA_KEEP_ALIVE):
+    # Ollama takes a bare number as seconds, but only as a JSON number
+    OLLAMA_KEEP_ALIVE = int(OLLAMA_KEEP_ALIVE)
+# Log each request's stage timings under a trace ID (the X-Request-ID header, or a generated one)
+TRACE_LOGGING = os.environ.get('TRACE_LOGGING', '0') == '1'
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
-# Database file for user authentication
-DATABASE = 'users.db'
+# Database file for user authentication (next to this file, not the working directory)
+DATABASE = os.environ.get('USER_DATABASE') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'users.db')
 
 # User Database Functions
+class UserStore:
+    """Thread-safe pool of connections to the user database.
+
+    Connections are opened on demand, up to `size`, and reused, so each keeps
+    the auth queries prepared in its statement cache. The database runs in WAL
+    mode, so logins (reads) never wait for a signup (write) to commit.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.idle = []  # open connections not in use
+        self.opened = 0
+        self.cond = threading.Condition()
+
+    def open(self):
+        conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = WAL')
+        # With WAL, NORMAL only syncs at checkpoints and can't corrupt the database
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; uncommitted changes are rolled back when it is returned"""
+        with self.cond:
+            while not self.idle and self.opened >= self.size:
+                self.cond.wait()
+            conn = self.idle.pop() if self.idle else None
+            if conn is None:
+                self.opened += 1
+        if conn is None:
+            try:
+                conn = self.open()
+            except Exception:
+                with self.cond:
+                    self.opened -= 1
+                    self.cond.notify()
+                raise
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            with self.cond:
+                self.idle.append(conn)
+                self.cond.notify()
+
+    def find_login(self, identifier):
+        """User row for a username or email, found with one unique-index lookup in the usual case"""
+        # Emails always contain '@' and usernames rarely do; the other column is only a fallback
+        columns = ('email', 'username') if '@' in identifier else ('username', 'email')
+        with self.connection() as conn:
+            for column in columns:
+                user = conn.execute(f'SELECT id, username, password_hash FROM users WHERE {column} = ?',
+                                    (identifier,)).fetchone()
+                if user is not None:
+                    return user
+        return None
+
+    def create_user(self, username, email, password_hash):
+        """Insert a user in one statement; returns the new ID, or None if the username or email is taken"""
+        with self.connection() as conn:
+            cursor = conn.execute('INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?) '
+                                  'ON CONFLICT DO NOTHING', (username, email, password_hash))
+            conn.commit()
+        return cursor.lastrowid if cursor.rowcount == 1 else None
+
+user_store = UserStore(DATABASE, USER_DB_POOL_SIZE)
+
+# Password hashes are deliberately slow and memory-hard (scrypt takes ~32MB each), so they are
+# computed on a fixed set of threads: a burst of logins queues instead of exhausting CPU and memory
+auth_executor = ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix='auth')
+
+def hash_password(password):
+    return auth_executor.submit(generate_password_hash, password, PASSWORD_HASH_METHOD).result()
+
+def verify_password(password_hash, password):
+    return auth_executor.submit(check_password_hash, password_hash, password).result()
+
 def init_db():
     """Initialize the user database"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def get_user_db():
-    """Get database connection for users"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    with user_store.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                email TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS workspaces (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL REFERENCES users (id),
+                name TEXT NOT NULL,
+                filename TEXT UNIQUE NOT NULL,
+                schema_sql TEXT NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                content_hash TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Databases created before uploads were deduplicated lack the hash column
+        if 'content_hash' not in [row[1] for row in cursor.execute('PRAGMA table_info(workspaces)')]:
+            cursor.execute('ALTER TABLE workspaces ADD COLUMN content_hash TEXT')
+        cursor.execute('CREATE INDEX IF NOT EXISTS workspaces_user_id ON workspaces (user_id)')
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS workspaces_user_content ON workspaces (user_id, content_hash)')
+        conn.commit()
 
 # Authentication Decorator
 def login_required(f):
@@ -60,181 +244,1507 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def convert_mysql_to_sqlite(schema_content):
-    """Convert MySQL syntax to SQLite-compatible syntax"""
-    # Remove backticks first (before other processing)
-    schema_content = schema_content.replace('`', '')
-    
-    # Remove comment lines
-    lines = schema_content.split('\n')
-    cleaned_lines = []
-    for line in lines:
-        stripped = line.strip()
-        # Skip comment lines and empty lines
-        if stripped.startswith('--') or not stripped or (stripped.startswith('/*') and stripped.endswith('*/')):
-            continue
-        cleaned_lines.append(stripped)
-    
-    # Join all lines into single string (SQL statements can be multi-line)
-    schema_content = ' '.join(cleaned_lines)
-    
-    # Find and process CREATE TABLE statements
-    # SQLite requires AUTOINCREMENT to be used with INTEGER PRIMARY KEY, not INTEGER NOT NULL AUTOINCREMENT
-    def fix_auto_increment_in_table(create_stmt):
-        """Fix AUTO_INCREMENT columns that are also PRIMARY KEY and remove MySQL-specific syntax"""
-        # Remove MySQL-specific syntax that comes after the closing parenthesis
-        # Find the last closing parenthesis and remove everything after it that matches MySQL syntax
-        last_paren = create_stmt.rfind(')')
-        if last_paren != -1:
-            table_def = create_stmt[:last_paren + 1]
-            remainder = create_stmt[last_paren + 1:]
-            # Remove MySQL-specific syntax from remainder
-            remainder = re.sub(r'\s*ENGINE\s*=\s*\w+', '', remainder, flags=re.IGNORECASE)
-            remainder = re.sub(r'\s*DEFAULT\s+CHARSET\s*=\s*\w+', '', remainder, flags=re.IGNORECASE)
-            remainder = re.sub(r'\s*CHARACTER\s+SET\s+\w+', '', remainder, flags=re.IGNORECASE)
-            remainder = re.sub(r'\s*AUTO_INCREMENT\s*=\s*\d+', '', remainder, flags=re.IGNORECASE)
-            remainder = re.sub(r'\s*COLLATE\s+\w+', '', remainder, flags=re.IGNORECASE)
-            create_stmt = table_def + remainder
-        
-        # Find column with AUTO_INCREMENT
-        # Pattern to match: column_name int(11) NOT NULL AUTO_INCREMENT or similar
-        autoinc_col_pattern = r'(\w+)\s+(?:int\(\d+\)|int\b|INTEGER)\s+(?:NOT\s+NULL\s+)?AUTO_INCREMENT'
-        match = re.search(autoinc_col_pattern, create_stmt, re.IGNORECASE)
-        
-        if match:
-            col_name = match.group(1)
-            # Check if there's a PRIMARY KEY constraint for this column
-            pk_constraint_pattern = r'PRIMARY\s+KEY\s*\(\s*' + re.escape(col_name) + r'\s*\)'
-            
-            if re.search(pk_constraint_pattern, create_stmt, re.IGNORECASE):
-                # Replace the column definition to use INTEGER PRIMARY KEY AUTOINCREMENT
-                # Match: col_name int(...) NOT NULL AUTO_INCREMENT (with variations)
-                col_def_to_replace = r'\b' + re.escape(col_name) + r'\s+(?:int\(\d+\)|int\b|INTEGER)\s+(?:NOT\s+NULL\s+)?AUTO_INCREMENT'
-                create_stmt = re.sub(col_def_to_replace, 
-                                    col_name + ' INTEGER PRIMARY KEY AUTOINCREMENT', 
-                                    create_stmt, flags=re.IGNORECASE)
-                
-                # Remove the separate PRIMARY KEY constraint
-                create_stmt = re.sub(pk_constraint_pattern + r'\s*,?\s*', '', create_stmt, flags=re.IGNORECASE)
+# Metrics: per-stage latency histograms and counters, exposed in Prometheus text format at /metrics
+
+# Latency buckets in seconds, from sub-millisecond SQLite work up to multi-minute generations
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class Metrics:
+    """Thread-safe counters and histograms, keyed by metric name and labels"""
+
+    def __init__(self, prefix, buckets):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.descriptions = {}  # name -> (type, help text)
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [count per bucket and +Inf, sum]
+        self.lock = threading.Lock()
+
+    def describe(self, name, kind, text):
+        self.descriptions[name] = (kind, text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(self.buckets) + 2)
+            histogram[bisect.bisect_left(self.buckets, value)] += 1
+            histogram[-1] += value
+
+    @staticmethod
+    def format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in pairs) + '}'
+
+    def render(self, gauges=()):
+        """Prometheus text exposition of every metric, plus (name, labels, value) gauges"""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, list(value)) for key, value in self.histograms.items())
+        samples = {}  # name -> sample lines
+        for (name, labels), value in counters:
+            samples.setdefault(name, []).append(f'{self.prefix}{name}{self.format_labels(labels)} {value!r}')
+        for (name, labels), histogram in histograms:
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), histogram):
+                cumulative += count
+                lines.append(f'{self.prefix}{name}_bucket{self.format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.prefix}{name}_sum{self.format_labels(labels)} {histogram[-1]!r}')
+            lines.append(f'{self.prefix}{name}_count{self.format_labels(labels)} {cumulative}')
+        for name, labels, value in gauges:
+            samples.setdefault(name, []).append(
+                f'{self.prefix}{name}{self.format_labels(sorted(labels.items()))} {value!r}')
         
-        return create_stmt
-    
-    # Split by semicolons to process each statement separately
-    # This is simpler and more reliable than trying to match nested parentheses
-    parts = schema_content.split(';')
-    processed_parts = []
-    for part in parts:
-        part = part.strip()
-        if not part:
-            continue
-        # Check if this is a CREATE TABLE statement
-        if re.match(r'CREATE\s+TABLE', part, re.IGNORECASE):
-            part = fix_auto_increment_in_table(part)
-        processed_parts.append(part)
-    
-    schema_content = '; '.join(processed_parts)
-    
-    # Convert INT(n) to INTEGER for all remaining columns
-    schema_content = re.sub(r'\bint\(\d+\)', 'INTEGER', schema_content, flags=re.IGNORECASE)
-    schema_content = re.sub(r'\bint\b(?!EGER)', 'INTEGER', schema_content, flags=re.IGNORECASE)
+        output = []
+        for name, lines in samples.items():
+            kind, text = self.descriptions.get(name, ('gauge', name.replace('_', ' ')))
+            output.append(f'# HELP {self.prefix}{name} {text}')
+            output.append(f'# TYPE {self.prefix}{name} {kind}')
+            output.extend(lines)
+        return '\n'.join(output) + '\n'
+
+metrics = Metrics('text2sql_', METRICS_BUCKETS)
+metrics.describe('stage_duration_seconds', 'histogram', 'Time spent in each stage of request handling')
+metrics.describe('http_request_duration_seconds', 'histogram', 'Time to produce a response (streamed bodies excluded)')
+metrics.describe('http_requests_total', 'counter', 'Requests handled, by endpoint and status')
+metrics.describe('ollama_tokens_total', 'counter', 'Tokens processed by Ollama, as reported in its responses')
+metrics.describe('ollama_duration_seconds_total', 'counter', 'Ollama time spent loading, reading the prompt and generating')
+metrics.describe('generation_candidates_total', 'counter', 'Multi-candidate generations, by outcome')
+
+# Trace ID of the request being handled; set in before_request when TRACE_LOGGING is on
+current_trace_id = contextvars.ContextVar('current_trace_id', default=None)
+if TRACE_LOGGING:
+    app.logger.setLevel(logging.INFO)
+
+def record_stage(stage, seconds):
+    metrics.observe('stage_duration_seconds', seconds, stage=stage)
+    trace_id = current_trace_id.get()
+    if trace_id is not None:
+        app.logger.info('trace=%s stage=%s duration_ms=%.1f', trace_id, stage, seconds * 1000)
+
+@contextmanager
+def stage_timer(stage):
+    """Record the time spent in the block (successful or not) as one observation of `stage`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+def timed_iter(iterable, elapsed):
+    """Yield from iterable, adding the time spent producing items to elapsed[0]"""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            elapsed[0] += time.perf_counter() - start
+        yield item
+
+def record_ollama_stats(data, model):
+    """Token counts and timings from a final Ollama response (durations are in nanoseconds)"""
+    if 'eval_count' in data:
+        metrics.inc('ollama_tokens_total', data['eval_count'], model=model, phase='eval')
+    if 'prompt_eval_count' in data:
+        metrics.inc('ollama_tokens_total', data['prompt_eval_count'], model=model, phase='prompt')
+    for phase in ('load', 'prompt_eval', 'eval'):
+        if f'{phase}_duration' in data:
+            metrics.inc('ollama_duration_seconds_total', data[f'{phase}_duration'] / 1e9, model=model, phase=phase)
+
+# MySQL -> SQLite schema translation
+#
+# The translator is a small tokenizer that walks the dump once, line by line,
+# tracking whether it is inside a string literal, identifier or comment. Only
+# complete statements are ever held in memory, and rewrites are applied to code
+# outside of string literals, so data containing ';', '--' or 'int' survives.
+
+# Characters that change tokenizer state outside of literals and comments
+_SQL_SPECIAL = re.compile(r"""['"`;#]|--(?=\s)|/\*""")
+# A run of code and backslash-free single-quoted literals needing no rewriting
+_PLAIN_RUN = re.compile(r"""(?:[^'"`;#/\-]+|'[^'\\]*'(?!')|-(?!-\s)|/(?!\*))+""")
+# Body of a quoted literal up to (not including) its closing quote
+_QUOTED_BODY = {
+    "'": re.compile(r"(?:[^'\\]|\\.|'')*", re.DOTALL),
+    '"': re.compile(r'(?:[^"\\]|\\.|"")*', re.DOTALL),
+    '`': re.compile(r'(?:[^`]|``)*'),
+}
+# MySQL session/locking statements that have no SQLite equivalent
+_MYSQL_ONLY_STATEMENTS = {'SET', 'LOCK', 'UNLOCK', 'START', 'COMMIT', 'USE'}
+_CREATE_TABLE = re.compile(
+    r'\s*CREATE\s+(?:TEMPORARY\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?([\w."]+)\s*\(', re.IGNORECASE)
+# A bare or double-quoted (translated backtick) identifier
+_IDENTIFIER = r'(?:"(?:[^"]|"")*"|\w+)'
+_PRIMARY_KEY_DEF = re.compile(rf'PRIMARY\s+KEY\b\s*(?:{_IDENTIFIER}\s*)?\((.*)\)', re.IGNORECASE | re.DOTALL)
+# Quoted column names such as "key" never match, since the keyword must come first
+_INDEX_DEF = re.compile(
+    rf'(UNIQUE\s+|FULLTEXT\s+|SPATIAL\s+)?(?:KEY|INDEX)\b\s*({_IDENTIFIER})?\s*\((.*)\)', re.IGNORECASE | re.DOTALL)
+_COLUMN_NAME = re.compile(rf'\s*({_IDENTIFIER})')
+# All column-level rewrites fused into one alternation
+_COLUMN_REWRITE = re.compile(r"""
+    (?P<int>\bint\s*\(\s*\d+\s*\)|\bint\b)
+  | (?P<enum>\b(?:enum|set)\s*\([^)]*\))
+  | (?P<drop>
+        \s+(?:UNSIGNED|ZEROFILL|AUTO_INCREMENT)\b
+      | \s+(?:CHARACTER\s+SET|CHARSET|COLLATE)\s*=?\s*\w+
+      | \s+COMMENT\s+\x00\d+\x00
+      | \s+ON\s+UPDATE\s+CURRENT_TIMESTAMP(?:\s*\(\s*\))?
+    )
+""", re.IGNORECASE | re.VERBOSE)
+_LITERAL_PLACEHOLDER = re.compile(r'\x00(\d+)\x00')
+_MYSQL_ESCAPE = re.compile(r'\\(.)|\'\'|""', re.DOTALL)
+_MYSQL_ESCAPES = {'0': '\x00', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a', '%': '\\%', '_': '\\_'}
+
+class _Literal(str):
+    """A quoted string literal inside a statement; never rewritten"""
+
+def _sqlite_literal(body, quote):
+    """Re-quote a MySQL string literal body using SQLite's '' escaping"""
+    if quote == "'" and '\\' not in body:
+        return "'" + body + "'"
+    def unescape(match):
+        if match.group(1) is not None:
+            return _MYSQL_ESCAPES.get(match.group(1), match.group(1))
+        # A doubled quote only escapes the literal's own quote character
+        return quote if match.group() == quote * 2 else match.group()
+    body = _MYSQL_ESCAPE.sub(unescape, body)
+    return "'" + body.replace("'", "''") + "'"
+
+def _iter_lines(text):
+    """Yield lines of a string without materializing a list of them"""
+    pos = 0
+    while True:
+        end = text.find('\n', pos)
+        if end == -1:
+            if pos < len(text):
+                yield text[pos:]
+            return
+        yield text[pos:end + 1]
+        pos = end + 1
+
+def _split_top_level(body):
+    """Split a table body on commas that are not nested in parentheses"""
+    items = []
+    depth = 0
+    last = 0
+    for i, ch in enumerate(body):
+        if ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        elif ch == ',' and depth == 0:
+            items.append(body[last:i].strip())
+            last = i + 1
+    items.append(body[last:].strip())
+    return [item for item in items if item]
+
+def _quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _unquote_identifier(name):
+    if len(name) >= 2 and name[0] == name[-1] == '"':
+        return name[1:-1].replace('""', '"')
+    return name
+
+def _rewrite_column(match):
+    if match.group('int'):
+        return 'INTEGER'
+    if match.group('enum'):
+        return 'TEXT'
+    return ''
+
+def _translate_create_table(code):
+    """Rewrite a MySQL CREATE TABLE (literals already replaced by placeholders)"""
+    match = _CREATE_TABLE.match(code)
+    if not match:
+        return [code.strip()]
+    table = match.group(1)
     
-    # Remove any remaining AUTO_INCREMENT (SQLite only supports AUTOINCREMENT with PRIMARY KEY)
-    schema_content = re.sub(r'\s+AUTO_INCREMENT\b', '', schema_content, flags=re.IGNORECASE)
+    # Find the parenthesis closing the table body
+    depth = 1
+    close = None
+    for i in range(match.end(), len(code)):
+        if code[i] == '(':
+            depth += 1
+        elif code[i] == ')':
+            depth -= 1
+            if depth == 0:
+                close = i
+                break
+    if close is None:
+        return [code.strip()]
+    defs = _split_top_level(code[match.end():close])
     
-    # Remove MySQL-specific syntax
-    schema_content = re.sub(r'\s*ENGINE\s*=\s*\w+', '', schema_content, flags=re.IGNORECASE)
-    schema_content = re.sub(r'\s*CHARACTER\s+SET\s+\w+', '', schema_content, flags=re.IGNORECASE)
-    schema_content = re.sub(r'\s*COLLATE\s+\w+', '', schema_content, flags=re.IGNORECASE)
-    schema_content = re.sub(r'\s*DEFAULT\s+CHARSET\s*=\s*\w+', '', schema_content, flags=re.IGNORECASE)
-    schema_content = re.sub(r'\bUNSIGNED\b', '', schema_content, flags=re.IGNORECASE)
-    schema_content = re.sub(r'\s*AUTO_INCREMENT\s*=\s*\d+\s*', ' ', schema_content, flags=re.IGNORECASE)
+    # SQLite only allows AUTOINCREMENT on an INTEGER PRIMARY KEY column, so a
+    # MySQL AUTO_INCREMENT column with a single-column PRIMARY KEY is fused
+    autoinc_col = None
+    for definition in defs:
+        if re.search(r'\bAUTO_INCREMENT\b', definition, re.IGNORECASE):
+            name = _COLUMN_NAME.match(definition)
+            autoinc_col = _unquote_identifier(name.group(1)).lower() if name else None
+            break
+    fuse_pk = False
+    if autoinc_col:
+        for definition in defs:
+            pk = _PRIMARY_KEY_DEF.match(definition)
+            if pk and _unquote_identifier(pk.group(1).strip()).lower() == autoinc_col:
+                fuse_pk = True
     
-    # Clean up multiple spaces and commas
-    schema_content = re.sub(r',\s*,', ',', schema_content)  # double commas
-    schema_content = re.sub(r',\s*\)', ')', schema_content)  # trailing comma
-    schema_content = re.sub(r'\s+', ' ', schema_content)  # multiple spaces
+    columns = []
+    indexes = []
+    for definition in defs:
+        pk = _PRIMARY_KEY_DEF.match(definition)
+        if pk:
+            if not fuse_pk:
+                columns.append(f"PRIMARY KEY ({pk.group(1).strip()})")
+            continue
+        index = _INDEX_DEF.match(definition)
+        if index:
+            kind = (index.group(1) or '').strip().upper()
+            # Drop MySQL prefix lengths such as name(10)
+            cols = re.sub(r'\(\s*\d+\s*\)', '', index.group(3)).strip()
+            if kind == 'UNIQUE':
+                columns.append(f"UNIQUE ({cols})")
+            elif not kind:
+                name = _unquote_identifier(index.group(2) or cols.split(',')[0].strip())
+                # Index names are per-table in MySQL but global in SQLite
+                index_name = _quote_identifier(_unquote_identifier(table) + '_' + name)
+                indexes.append(f'CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({cols})')
+            continue
+        if re.match(r'(?:CONSTRAINT\b|FOREIGN\s+KEY\b|CHECK\b)', definition, re.IGNORECASE):
+            columns.append(definition)
+            continue
+        name = _COLUMN_NAME.match(definition)
+        if name is None:
+            columns.append(definition)
+            continue
+        col_name = name.group(1)
+        if fuse_pk and _unquote_identifier(col_name).lower() == autoinc_col:
+            columns.append(f"{col_name} INTEGER PRIMARY KEY AUTOINCREMENT")
+            continue
+        # Only the type and attributes are rewritten, never the name (a column may be called "int")
+        columns.append(col_name + _COLUMN_REWRITE.sub(_rewrite_column, definition[name.end():]))
     
-    # Ensure semicolons separate statements properly
-    schema_content = re.sub(r'\s*;\s*', ';', schema_content)
+    # Everything after the body is MySQL table options (ENGINE=, CHARSET=, ...)
+    create = code[:match.end()] + ', '.join(columns) + ')'
+    return [create] + indexes
+
+def _translate_statement(parts, keyword):
+    """Turn the tokens of one MySQL statement into zero or more SQLite statements"""
+    if keyword is None or keyword in _MYSQL_ONLY_STATEMENTS:
+        return []
+    if keyword != 'CREATE':
+        return [''.join(parts).strip()]
     
-    return schema_content
+    literals = []
+    code = []
+    for part in parts:
+        if isinstance(part, _Literal):
+            code.append(f'\x00{len(literals)}\x00')
+            literals.append(part)
+        else:
+            code.append(part)
+    statements = _translate_create_table(''.join(code))
+    return [_LITERAL_PLACEHOLDER.sub(lambda m: literals[int(m.group(1))], stmt).strip() for stmt in statements]
+
+def iter_sqlite_statements(source):
+    """Stream SQLite-ready statements from a MySQL dump.
+
+    `source` may be a string or any iterable of lines (such as an open file).
+    The input is scanned once; each statement is yielded as soon as its
+    terminating semicolon is seen.
+    """
+    lines = _iter_lines(source) if isinstance(source, str) else source
+    parts = []
+    literal = []
+    keyword = None  # first word of the current statement
+    state = None  # None, a quote character, or '/*'
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        pos = 0
+        length = len(line)
+        while pos < length:
+            if state is None:
+                if keyword is not None and keyword != 'CREATE':
+                    # Data statements need no rewriting: take plain code and simple
+                    # literals in one match (this is nearly every line of a dump)
+                    match = _PLAIN_RUN.match(line, pos)
+                    if match:
+                        parts.append(match.group())
+                        pos = match.end()
+                        if pos >= length:
+                            break
+                match = _SQL_SPECIAL.search(line, pos)
+                chunk = line[pos:match.start()] if match else line[pos:]
+                if chunk:
+                    parts.append(chunk)
+                    if keyword is None and chunk.strip():
+                        keyword = chunk.split(None, 1)[0].upper()
+                if match is None:
+                    break
+                token = match.group()
+                pos = match.end()
+                if token == ';':
+                    yield from _translate_statement(parts, keyword)
+                    parts = []
+                    keyword = None
+                elif token == '/*':
+                    state = '/*'
+                elif token in ("'", '"', '`'):
+                    state = token
+                    literal = []
+                else:
+                    # '--' or '#' comment runs to the end of the line
+                    parts.append('\n')
+                    break
+            elif state == '/*':
+                end = line.find('*/', pos)
+                if end == -1:
+                    break
+                pos = end + 2
+                state = None
+                parts.append(' ')
+            else:
+                match = _QUOTED_BODY[state].match(line, pos)
+                literal.append(match.group())
+                pos = match.end()
+                if pos < length:
+                    # Stopped on the closing quote
+                    pos += 1
+                    if state == '`':
+                        # Backtick identifiers become standard quoted names, which also
+                        # keeps reserved words such as `group` or `key` usable
+                        name = ''.join(literal).replace('``', '`')
+                        parts.append(_quote_identifier(name))
+                        if keyword is None:
+                            keyword = name.upper()
+                    else:
+                        parts.append(_Literal(_sqlite_literal(''.join(literal), state)))
+                    state = None
+    if parts:
+        yield from _translate_statement(parts, keyword)
+
+# Header of an INSERT/REPLACE ... VALUES statement, up to its first row
+_INSERT_HEAD = re.compile(
+    r'(?:INSERT|REPLACE)\s+(?:OR\s+\w+\s+)?(?:INTO\s+)?[\w."]+\s*(?:\([^()]*\)\s*)?VALUES?\s*(?=\()',
+    re.IGNORECASE)
+_CREATE_INDEX = re.compile(r'CREATE\s+(?:UNIQUE\s+)?INDEX\b', re.IGNORECASE)
+
+def _execute_schema_statement(conn, statement):
+    """Execute one schema statement, tolerating tables that already exist"""
+    try:
+        conn.execute(statement)
+    except sqlite3.Error as e:
+        # If it's a table already exists error, that's okay (IF NOT EXISTS)
+        if isinstance(e, sqlite3.OperationalError) and 'already exists' in str(e).lower():
+            return
+        raise Exception(f"Error executing schema: {str(e)}. Statement that failed: {statement[:100]}")
+
+def load_schema_statements(conn, statements):
+    """Execute schema statements one at a time"""
+    for statement in statements:
+        _execute_schema_statement(conn, statement)
+    conn.commit()
 
-def get_db_connection(schema_content):
+def bulk_load_schema_statements(conn, statements):
+    """Load schema statements in a single transaction tuned for bulk inserts.
+
+    Journaling and syncing are turned off for the load, consecutive INSERTs
+    into the same table are merged into multi-row INSERTs of up to
+    SCHEMA_INSERT_BATCH_BYTES, and indexes are built once all data is in.
+    """
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    conn.execute('BEGIN')
+    indexes = []
+    batch_head = None
+    batch_rows = []
+    batch_bytes = 0
+    for statement in statements:
+        head = _INSERT_HEAD.match(statement) if statement[:1] in 'IiRr' else None
+        if head:
+            if head.group() != batch_head or batch_bytes >= SCHEMA_INSERT_BATCH_BYTES:
+                if batch_rows:
+                    _execute_schema_statement(conn, batch_head + ','.join(batch_rows))
+                batch_head = head.group()
+                batch_rows = []
+                batch_bytes = 0
+            batch_rows.append(statement[head.end():])
+            batch_bytes += len(statement)
+            continue
+        if batch_rows:
+            _execute_schema_statement(conn, batch_head + ','.join(batch_rows))
+            batch_head = None
+            batch_rows = []
+            batch_bytes = 0
+        if _CREATE_INDEX.match(statement):
+            indexes.append(statement)
+        else:
+            _execute_schema_statement(conn, statement)
+    if batch_rows:
+        _execute_schema_statement(conn, batch_head + ','.join(batch_rows))
+    for statement in indexes:
+        _execute_schema_statement(conn, statement)
+    conn.execute('COMMIT')
+    conn.isolation_level = isolation_level
+
+def load_translated_schema(conn, source, bulk=None):
+    """Translate a MySQL dump and load it into conn, timing the two stages separately"""
+    if bulk is None:
+        bulk = SCHEMA_BULK_LOAD
+    # Translation is interleaved with loading, so its share is timed statement by statement
+    conversion = [0.0]
+    start = time.perf_counter()
+    statements = timed_iter(iter_sqlite_statements(source), conversion)
+    if bulk:
+        bulk_load_schema_statements(conn, statements)
+    else:
+        load_schema_statements(conn, statements)
+    record_stage('conversion', conversion[0])
+    record_stage('schema_load', time.perf_counter() - start - conversion[0])
+
+def build_schema_db(schema_content, bulk=None):
     """Create an in-memory SQLite database from schema content"""
-    conn = sqlite3.connect(':memory:')
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
     conn.row_factory = sqlite3.Row
     
-    # Convert MySQL syntax to SQLite-compatible syntax
-    schema_content = convert_mysql_to_sqlite(schema_content)
-    
-    # Execute schema SQL
+    # Translate and execute the schema one statement at a time
     try:
-        # Split by semicolons and execute each statement
-        statements = [s.strip() for s in schema_content.split(';') if s.strip()]
-        for statement in statements:
-            if statement:
-                # Skip comments and empty statements
-                if statement.strip().startswith('--') or statement.strip().startswith('/*'):
-                    continue
-                # Skip non-SQL lines (like -- comments)
-                if statement.strip() and not statement.strip().startswith('--'):
-                    try:
-                        conn.execute(statement)
-                    except sqlite3.OperationalError as e:
-                        # If it's a table already exists error, that's okay (IF NOT EXISTS)
-                        if 'already exists' not in str(e).lower():
-                            raise
-        conn.commit()
-    except Exception as e:
+        load_translated_schema(conn, schema_content, bulk)
+    except Exception:
         conn.close()
-        raise Exception(f"Error executing schema: {str(e)}. Statement that failed: {statement[:100] if 'statement' in locals() else 'unknown'}")
+        raise
     
     return conn
 
-def generate_sql_with_ai(natural_language_query, schema_content, model=None):
-    """Generate SQL query using Ollama API (local)"""
+def schema_hash(schema_content):
+    """Content hash used to key per-schema caches"""
+    if isinstance(schema_content, Workspace):
+        return schema_content.key
+    # Several caches hash the same (possibly 16MB) schema string per request, so the hash is
+    # remembered on `g` for the rest of the request (or CLI command), and dropped with it.
+    # Batch workers run in a copy of the request's context and share it.
+    memo = g.setdefault('schema_hashes', {}) if has_app_context() else None
+    if memo is not None:
+        # id(schema) -> (schema, hash); holding the string keeps its id unique
+        entry = memo.get(id(schema_content))
+        if entry is not None and entry[0] is schema_content:
+            return entry[1]
+    digest = hashlib.sha256(schema_content.encode('utf-8')).hexdigest()
+    if memo is not None:
+        memo[id(schema_content)] = (schema_content, digest)
+    return digest
+
+class SchemaCache:
+    """LRU cache of materialized schema databases keyed by schema hash.
+
+    The cached databases are never handed out directly: callers get a private
+    in-memory copy made with the SQLite backup API, so DML run by one request
+    can never leak into another. Each template has its own lock, so copying
+    one schema never holds up requests on another (or the stats).
+    Read-only statements that run for a while use a shared snapshot instead
+    (see `snapshot`), so they don't hold the template lock either.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # hash -> (template connection, size in bytes, template lock)
+        self.snapshots = {}  # hash -> (snapshot URI, connection keeping it alive, size in bytes)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        # Per-hash build locks so concurrent misses on one schema only build it once
+        self.build_locks = {}
+
+    def get_template(self, schema_content):
+        """Return the cached template database for a schema, building it on a miss"""
+        return self.get_entry(schema_content)[0]
+
+    def get_entry(self, schema_content):
+        """(template, template lock) for a schema, building the template on a miss"""
+        key = schema_hash(schema_content)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], entry[2]
+            build_lock = self.build_locks.setdefault(key, threading.Lock())
+        
+        with build_lock:
+            # Another request may have finished building while we waited
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0], entry[2]
+                self.misses += 1
+            try:
+                template = build_schema_db(schema_content)
+                template_lock = threading.Lock()
+                self.put(key, template, template_lock)
+            finally:
+                with self.lock:
+                    self.build_locks.pop(key, None)
+            return template, template_lock
+
+    def put(self, key, template, template_lock):
+        size = database_size(template)
+        with self.lock:
+            if size > self.max_bytes:
+                # Too big to ever fit; serve this request but don't keep it
+                self.evictions += 1
+                return
+            self.entries[key] = (template, size, template_lock)
+            self.total_bytes += size
+            self.evict()
+
+    def evict(self):
+        """Drop least recently used schemas until the cache fits its budget; call with the lock held"""
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            # Not closed explicitly: a concurrent request may still be copying from it
+            old_key, (_, old_size, _) = self.entries.popitem(last=False)
+            self.total_bytes -= old_size + self.drop_snapshot(old_key)
+            self.evictions += 1
+
+    def drop_snapshot(self, key):
+        """Forget a schema's snapshot and return its size; call with the lock held"""
+        snapshot = self.snapshots.pop(key, None)
+        if snapshot is None:
+            return 0
+        # Connections already open on the snapshot keep it alive until they close
+        snapshot[1].close()
+        return snapshot[2]
+
+    def connect(self, schema_content, read_only=False):
+        """Return a private, writable copy of the materialized schema.
+
+        Workspaces are not cached: they are copied from their file, or with
+        `read_only` the file itself is opened.
+        """
+        if isinstance(schema_content, Workspace):
+            source = open_workspace_db(schema_content)
+            if read_only:
+                return source
+            conn = sqlite3.connect(':memory:', check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            with stage_timer('schema_copy'):
+                source.backup(conn)
+            source.close()
+            return conn
+        template, template_lock = self.get_entry(schema_content)
+        conn = sqlite3.connect(':memory:', check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # Backups read from the shared template, so serialize them on its lock
+        with template_lock, stage_timer('schema_copy'):
+            template.backup(conn)
+        return conn
+
+    def snapshot(self, schema_content):
+        """Read-only connection to a shared copy of a schema's database.
+
+        The copy is a shared-cache in-memory database made once per cached
+        schema, so any number of readers can use it at once without the
+        template lock. It doesn't see indexes created on the template later.
+        """
+        if isinstance(schema_content, Workspace):
+            return open_workspace_db(schema_content)
+        key = schema_hash(schema_content)
+        with self.lock:
+            if key in self.snapshots:
+                return self.open_snapshot(self.snapshots[key][0])
+        template, template_lock = self.get_entry(schema_content)
+        uri = f'file:snapshot-{secrets.token_hex(8)}?mode=memory&cache=shared'
+        anchor = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        with template_lock, stage_timer('schema_copy'):
+            template.backup(anchor)
+        size = database_size(anchor)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is template and key not in self.snapshots:
+                self.snapshots[key] = (uri, anchor, size)
+                self.total_bytes += size
+                # Opened before evict() so the snapshot outlives its own eviction
+                conn = self.open_snapshot(uri)
+                self.evict()
+                return conn
+        # Not kept (the schema is too big to cache, or another request kept one first): use it privately
+        anchor.execute('PRAGMA query_only = 1')
+        return anchor
+
+    @staticmethod
+    def open_snapshot(uri):
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.execute('PRAGMA query_only = 1')
+        return conn
+
+    def with_template(self, schema_content, func):
+        """Run func(template) with exclusive access to the cached database for a schema"""
+        if isinstance(schema_content, Workspace):
+            conn = open_workspace_db(schema_content)
+            try:
+                return func(conn)
+            finally:
+                conn.close()
+        template, template_lock = self.get_entry(schema_content)
+        key = schema_hash(schema_content)
+        with template_lock:
+            result = func(template)
+            # func may have grown the database (e.g. by creating indexes)
+            size = database_size(template)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is template:
+                self.total_bytes += size - entry[1]
+                self.entries[key] = (template, size, template_lock)
+        return result
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.snapshots):
+                self.drop_snapshot(key)
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'snapshots': len(self.snapshots),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+def database_size(conn):
+    """Approximate memory footprint of a SQLite database in bytes"""
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    return page_count * page_size
+
+schema_cache = SchemaCache(SCHEMA_CACHE_MAX_BYTES)
+
+def get_db_connection(schema_content, read_only=False):
+    """Get a private in-memory SQLite database for the schema, served from the schema cache"""
+    return schema_cache.connect(schema_content, read_only)
+
+# Schema workspaces: a dump is uploaded once, converted to a SQLite file, and referred to by ID
+
+class WorkspaceNotFound(Exception):
+    pass
+
+class Workspace(str):
+    """A stored workspace, usable wherever schema text is.
+
+    The string value is the workspace's DDL, which is all prompt building
+    needs. `key` stands in for the content hash in the per-schema caches, and
+    queries open the database file at `path` instead of a cached copy.
+    """
+
+    def __new__(cls, row):
+        workspace = super().__new__(cls, row['schema_sql'])
+        workspace.id = row['id']
+        workspace.path = os.path.join(WORKSPACE_FOLDER, row['filename'])
+        workspace.key = 'workspace:' + row['filename']
+        return workspace
+
+def open_workspace_db(workspace):
+    """Read-only, memory-mapped connection to a workspace's database file"""
+    # Workspace files never change once written, so SQLite can skip file locking
+    uri = 'file:' + urllib.parse.quote(os.path.abspath(workspace.path)) + '?mode=ro&immutable=1'
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f'PRAGMA mmap_size = {WORKSPACE_MMAP_SIZE}')
+    return conn
+
+def find_workspace(user_id, content_hash):
+    """The user's workspace made from an upload with this content hash, or None"""
+    with user_store.connection() as db:
+        row = db.execute('SELECT * FROM workspaces WHERE user_id = ? AND content_hash = ?',
+                         (user_id, content_hash)).fetchone()
+    if row is None:
+        return None
+    workspace = Workspace(row)
+    conn = open_workspace_db(workspace)
+    try:
+        tables = [name for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY rowid")]
+    finally:
+        conn.close()
+    return {'id': row['id'], 'name': row['name'], 'tables': tables, 'size_bytes': row['size_bytes']}
+
+def create_workspace(user_id, name, source, content_hash=None):
+    """Convert a MySQL dump (text or lines) into a new workspace for the user"""
+    os.makedirs(WORKSPACE_FOLDER, exist_ok=True)
+    filename = f'{user_id}-{secrets.token_hex(8)}.sqlite'
+    path = os.path.join(WORKSPACE_FOLDER, filename)
+    # Built under a temporary name so a failed upload never leaves a half-written workspace
+    building = path + '.tmp'
+    conn = sqlite3.connect(building)
+    try:
+        load_translated_schema(conn, source)
+        definitions = conn.execute(
+            "SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY rowid").fetchall()
+        conn.close()
+        tables = [row[1] for row in definitions if row[0] == 'table']
+        if not tables:
+            raise Exception('No tables found in the schema file')
+        os.replace(building, path)
+    except Exception:
+        conn.close()
+        os.remove(building)
+        raise
+    
+    size = os.path.getsize(path)
+    try:
+        with user_store.connection() as db:
+            cursor = db.execute('INSERT INTO workspaces (user_id, name, filename, schema_sql, size_bytes, content_hash) '
+                                'VALUES (?, ?, ?, ?, ?, ?)',
+                                (user_id, name, filename, ';\n'.join(row[2] for row in definitions), size, content_hash))
+            db.commit()
+    except sqlite3.IntegrityError:
+        # The same file was uploaded concurrently and the other upload won
+        os.remove(path)
+        existing = find_workspace(user_id, content_hash) if content_hash else None
+        if existing is None:
+            raise
+        return existing
+    except Exception:
+        os.remove(path)
+        raise
+    return {'id': cursor.lastrowid, 'name': name, 'tables': tables, 'size_bytes': size}
+
+def get_workspace(user_id, workspace_id):
+    """The user's workspace with this ID"""
+    with user_store.connection() as db:
+        row = db.execute('SELECT * FROM workspaces WHERE id = ? AND user_id = ?', (workspace_id, user_id)).fetchone()
+    if row is None:
+        raise WorkspaceNotFound(f'Workspace {workspace_id} not found')
+    return Workspace(row)
+
+def request_schema(data):
+    """Schema a request works on: the user's workspace if `workspace_id` is given, else the `schema` text"""
+    workspace_id = data.get('workspace_id')
+    if workspace_id is None:
+        return data.get('schema', '').strip()
+    return get_workspace(session.get('user_id'), workspace_id)
+
+class OllamaClient:
+    """HTTP client for the Ollama API.
+
+    Owns a single requests.Session whose keep-alive connection pool is shared by
+    every Flask worker thread, so requests reuse open TCP connections instead of
+    connecting to Ollama on each call.
+    """
+
+    def __init__(self, api_url, pool_size=10, connect_timeout=5, read_timeout=300):
+        self.api_url = api_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+
+    def url(self, endpoint):
+        """URL of another Ollama endpoint, e.g. '/api/tags', on the configured server"""
+        return self.api_url.replace('/api/chat', endpoint)
+
+    def get(self, endpoint, timeout=None, **kwargs):
+        return self.session.get(self.url(endpoint), timeout=timeout or self.timeout, **kwargs)
+
+    def post(self, endpoint, payload, timeout=None, **kwargs):
+        return self.session.post(self.url(endpoint), json=payload, timeout=timeout or self.timeout, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+ollama_client = OllamaClient(OLLAMA_API_URL, pool_size=OLLAMA_POOL_SIZE,
+                             connect_timeout=OLLAMA_CONNECT_TIMEOUT, read_timeout=OLLAMA_READ_TIMEOUT)
+
+class ModelRegistry:
+    """Cached view of the models installed on the Ollama server.
+
+    The tag list is fetched once and then refreshed in the background every
+    `ttl` seconds, so generation requests never wait on /api/tags. Model names
+    are indexed by full name, base name and `base:latest` for O(1) lookups.
+    The registry also remembers whether the server supports /api/chat.
+    """
+
+    def __init__(self, client, ttl=60):
+        self.client = client
+        self.ttl = ttl
+        self.aliases = None  # alias -> installed model name; None until a load succeeds
+        self.loaded_at = None
+        self.refreshing = False
+        self.chat_supported = None  # None until the first /api/chat call
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Reload the tag list from Ollama; keeps the previous list if that fails"""
+        aliases = None
+        try:
+            with stage_timer('tags_probe'):
+                response = self.client.get('/api/tags', timeout=OLLAMA_CONNECT_TIMEOUT)
+                response.raise_for_status()
+                names = [m['name'] for m in response.json()['models']]
+            aliases = self.build_aliases(names)
+        except Exception as e:
+            # Unreachable, or a response of the wrong shape: treated alike
+            app.logger.warning('Could not load the model list from Ollama: %s', e)
+        finally:
+            # Always reset, or a failed background refresh would stop all later ones
+            with self.lock:
+                if aliases is not None:
+                    self.aliases = aliases
+                self.loaded_at = time.monotonic()
+                self.refreshing = False
+
+    @staticmethod
+    def build_aliases(names):
+        aliases = {}
+        # ':latest' tags are indexed first so they win the base-name aliases
+        for name in sorted(names, key=lambda n: not n.endswith(':latest')):
+            base = name.split(':')[0]
+            aliases[name] = name
+            aliases.setdefault(base, name)
+            aliases.setdefault(f"{base}:latest", name)
+        return aliases
+
+    def get_aliases(self):
+        """Current alias index, loading it on first use and refreshing it when stale"""
+        with self.lock:
+            first_load = self.loaded_at is None
+            if not first_load and not self.refreshing and time.monotonic() - self.loaded_at > self.ttl:
+                self.refreshing = True
+                threading.Thread(target=self.refresh, daemon=True).start()
+        if first_load:
+            self.refresh()
+        return self.aliases
+
+    def resolve(self, model):
+        """Installed name for `model`, False if it isn't installed, None if unknown.
+
+        A bare name or `name:latest` resolves to an installed tag of that
+        model; an explicit tag only resolves to itself.
+        """
+        aliases = self.get_aliases()
+        if aliases is None:
+            return None
+        return aliases.get(model) or False
+
+    def installed_names(self):
+        return sorted(set((self.aliases or {}).values()))
+
+model_registry = ModelRegistry(ollama_client, ttl=OLLAMA_MODELS_TTL)
+
+def normalize_query(natural_language_query):
+    """Canonical form of a question used for cache lookups"""
+    text = ' '.join(natural_language_query.lower().split())
+    return text.rstrip('?.!; ')
+
+# MinHash parameters: one (a, b) pair per signature slot, fixed so signatures are stable across restarts
+_MINHASH_PRIME = (1 << 61) - 1
+_MINHASH_SEEDS = random.Random(1)
+_MINHASH_PARAMS = [(_MINHASH_SEEDS.randrange(1, _MINHASH_PRIME), _MINHASH_SEEDS.randrange(_MINHASH_PRIME))
+                   for _ in range(64)]
+_MINHASH_BANDS = 16  # LSH bands of 4 slots each
+
+def minhash_signature(text, n=3):
+    """MinHash signature of the character n-grams of `text`"""
+    shingles = {text[i:i + n] for i in range(max(1, len(text) - n + 1))}
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'big') for s in shingles]
+    return tuple(min((a * h + b) % _MINHASH_PRIME for h in hashes) for a, b in _MINHASH_PARAMS)
+
+class GenerationCache:
+    """Two-level cache of generated SQL.
+
+    Level one is an exact match on (normalized question, schema hash, model,
+    options). Level two, enabled when `similarity` > 0, finds near-duplicate
+    questions for the same schema/model/options with MinHash over character
+    3-grams, using LSH buckets so lookups don't scan every entry. Entries
+    expire after `ttl` seconds and are LRU-evicted beyond `max_entries`; with
+    `path` set they are also persisted to a SQLite file and reloaded on startup.
+    """
+
+    def __init__(self, max_entries=1000, ttl=86400, similarity=0.0, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.path = path
+        self.entries = OrderedDict()  # key -> (scope, query, sql, created_at, signature)
+        self.buckets = {}  # (scope, band, band signature) -> set of keys
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        if path:
+            self.load()
+
+    @staticmethod
+    def make_scope(schema_content, model, options):
+        return f"{schema_hash(schema_content)}:{model}:{json.dumps(options, sort_keys=True)}"
+
+    @staticmethod
+    def make_key(scope, query):
+        return hashlib.sha256(f"{scope}\n{query}".encode('utf-8')).hexdigest()
+
+    def get(self, natural_language_query, schema_content, model, options):
+        """Cached SQL for the question, or None"""
+        query = normalize_query(natural_language_query)
+        scope = self.make_scope(schema_content, model, options)
+        key = self.make_key(scope, query)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[3] <= self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            if entry is not None:
+                self.remove(key)
+                self.evictions += 1
+            if self.similarity > 0:
+                match = self.find_similar(scope, query, now)
+                if match is not None:
+                    self.entries.move_to_end(match)
+                    self.near_hits += 1
+                    return self.entries[match][2]
+            self.misses += 1
+            return None
+
+    def find_similar(self, scope, query, now):
+        signature = minhash_signature(query)
+        rows = len(signature) // _MINHASH_BANDS
+        candidates = set()
+        for band in range(_MINHASH_BANDS):
+            candidates |= self.buckets.get((scope, band, signature[band * rows:(band + 1) * rows]), set())
+        best, best_score = None, self.similarity
+        for key in candidates:
+            entry = self.entries[key]
+            if now - entry[3] > self.ttl:
+                continue
+            score = sum(x == y for x, y in zip(signature, entry[4])) / len(signature)
+            if score >= best_score:
+                best, best_score = key, score
+        return best
+
+    def put(self, natural_language_query, schema_content, model, options, sql, created_at=None, persist=True):
+        query = normalize_query(natural_language_query)
+        scope = self.make_scope(schema_content, model, options)
+        self.insert(scope, query, sql, created_at or time.time(), persist)
+
+    def insert(self, scope, query, sql, created_at, persist=True):
+        key = self.make_key(scope, query)
+        signature = minhash_signature(query) if self.similarity > 0 else None
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (scope, query, sql, created_at, signature)
+            if signature is not None:
+                rows = len(signature) // _MINHASH_BANDS
+                for band in range(_MINHASH_BANDS):
+                    self.buckets.setdefault((scope, band, signature[band * rows:(band + 1) * rows]), set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+        if persist and self.path:
+            self.persist(key, scope, query, sql, created_at)
+
+    def persist(self, key, scope, query, sql, created_at):
+        """Write an entry to the cache file; failures are logged, as the SQL is already generated"""
+        conn = None
+        try:
+            # Best effort, so don't hold the request for long behind another writer
+            conn = sqlite3.connect(self.path, timeout=1)
+            conn.execute('INSERT OR REPLACE INTO generation_cache (key, scope, query, sql, created_at) VALUES (?, ?, ?, ?, ?)',
+                         (key, scope, query, sql, created_at))
+            conn.commit()
+        except sqlite3.Error as e:
+            app.logger.warning('Could not persist generation cache entry to %s: %s', self.path, e)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def remove(self, key):
+        """Drop an entry from memory and the LSH buckets (caller holds the lock)"""
+        scope, _, _, _, signature = self.entries.pop(key)
+        if signature is not None:
+            rows = len(signature) // _MINHASH_BANDS
+            for band in range(_MINHASH_BANDS):
+                bucket_key = (scope, band, signature[band * rows:(band + 1) * rows])
+                bucket = self.buckets.get(bucket_key)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self.buckets[bucket_key]
+
+    def load(self):
+        """Create the persistence table if needed and load unexpired entries"""
+        conn = sqlite3.connect(self.path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS generation_cache (
+                key TEXT PRIMARY KEY,
+                scope TEXT NOT NULL,
+                query TEXT NOT NULL,
+                sql TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        cutoff = time.time() - self.ttl
+        conn.execute('DELETE FROM generation_cache WHERE created_at < ?', (cutoff,))
+        conn.commit()
+        rows = conn.execute('SELECT scope, query, sql, created_at FROM generation_cache ORDER BY created_at DESC LIMIT ?',
+                            (self.max_entries,)).fetchall()
+        conn.close()
+        for scope, query, sql, created_at in reversed(rows):
+            self.insert(scope, query, sql, created_at, persist=False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'near_hits': self.near_hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+generation_cache = GenerationCache(max_entries=GENERATION_CACHE_SIZE, ttl=GENERATION_CACHE_TTL,
+                                   similarity=GENERATION_CACHE_SIMILARITY, path=GENERATION_CACHE_PATH)
+
+class SchedulerBusy(Exception):
+    """Raised when the LLM request queue is full; `retry_after` is a suggested wait in seconds"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class FairScheduler:
+    """Bounded-concurrency admission control for calls to the LLM backend.
+
+    At most `max_concurrency` generations run at once. Further requests wait in
+    per-user FIFO queues that are served round-robin, so one user submitting
+    many requests can't starve the others. Once `max_queue` requests are
+    waiting, new ones are rejected with SchedulerBusy. A waiting request can
+    be withdrawn with `cancel`.
+    """
+
+    def __init__(self, max_concurrency, max_queue, queue_timeout):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.queues = OrderedDict()  # user -> deque of waiting tickets, in round-robin order
+        self.avg_duration = 5.0  # moving average of slot hold time, for Retry-After
+        self.admitted = 0
+        self.rejected = 0
+
+    def retry_after(self):
+        return max(1, math.ceil(self.avg_duration * (self.waiting + 1) / self.max_concurrency))
+
+    def check_admission(self):
+        """Raise SchedulerBusy if a new request would be rejected right now"""
+        with self.cond:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise SchedulerBusy('Too many pending requests, please retry later', self.retry_after())
+
+    def acquire(self, user, cancelled=None):
+        """Wait for a slot; False if the `cancelled` event is set (via cancel()) first"""
+        with self.cond:
+            if cancelled is not None and cancelled.is_set():
+                return False
+            if self.active < self.max_concurrency and self.waiting == 0:
+                self.active += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise SchedulerBusy('Too many pending requests, please retry later', self.retry_after())
+            ticket = object()
+            queue = self.queues.setdefault(user, deque())
+            queue.append(ticket)
+            self.waiting += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while True:
+                    # The next ticket to run is the head of the first user's queue
+                    if self.active < self.max_concurrency and next(iter(self.queues.values()))[0] is ticket:
+                        queue.popleft()
+                        # Move this user to the back of the round-robin order
+                        del self.queues[user]
+                        if queue:
+                            self.queues[user] = queue
+                        self.active += 1
+                        self.admitted += 1
+                        # Another slot may still be free for the next user in line
+                        self.cond.notify_all()
+                        return True
+                    if cancelled is not None and cancelled.is_set():
+                        self.withdraw(user, queue, ticket)
+                        return False
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.withdraw(user, queue, ticket)
+                        self.rejected += 1
+                        raise SchedulerBusy('Timed out waiting for the model, please retry later', self.retry_after())
+                    self.cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+
+    def withdraw(self, user, queue, ticket):
+        """Take a ticket out of the queue; call with the condition held"""
+        queue.remove(ticket)
+        if not queue:
+            del self.queues[user]
+        # The ticket may have been at the head of the line
+        self.cond.notify_all()
+
+    def cancel(self, cancelled):
+        """Set a cancel event and wake its waiting requests, so they leave the queue now"""
+        cancelled.set()
+        with self.cond:
+            self.cond.notify_all()
+
+    def release(self, duration):
+        with self.cond:
+            self.active -= 1
+            self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+            self.cond.notify_all()
+
+    @contextmanager
+    def slot(self, user, cancelled=None):
+        """Hold a slot for the block; yields False, without one, if `cancelled` was set while waiting"""
+        with stage_timer('queue_wait'):
+            admitted = self.acquire(user, cancelled)
+        if not admitted:
+            yield False
+            return
+        start = time.monotonic()
+        try:
+            yield True
+        finally:
+            self.release(time.monotonic() - start)
+
+    def stats(self):
+        with self.cond:
+            return {
+                'active': self.active,
+                'waiting': self.waiting,
+                'max_concurrency': self.max_concurrency,
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'rejected': self.rejected
+            }
+
+llm_scheduler = FairScheduler(OLLAMA_MAX_CONCURRENCY, OLLAMA_MAX_QUEUE, OLLAMA_QUEUE_TIMEOUT)
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it is
+    in flight wait and receive its result, or re-raise its exception. If the
+    leader is interrupted without an ordinary exception (e.g. its generator was
+    closed), a waiting caller takes over and runs the function itself. do()
+    and stream() share their calls, so a key is only ever run once at a time.
+    """
+
+    class Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.cancelled = False
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def join(self, key):
+        """(call, True) if the caller leads the call for key, else (the leader's call, False)"""
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = self.calls[key] = self.Call()
+                self.executed += 1
+                return call, True
+            self.coalesced += 1
+            return call, False
+
+    def follow(self, call):
+        """Wait for the leader's call to end; False if it was cancelled and the caller should retry"""
+        call.done.wait()
+        if call.cancelled:
+            return False
+        if call.error is not None:
+            raise call.error
+        return True
+
+    def finish(self, key, call):
+        with self.lock:
+            del self.calls[key]
+        call.done.set()
+
+    def do(self, key, func):
+        while True:
+            call, leader = self.join(key)
+            if leader:
+                break
+            if self.follow(call):
+                return call.result
+        
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        except BaseException:
+            call.cancelled = True
+            raise
+        finally:
+            self.finish(key, call)
+        return call.result
+
+    def stream(self, key, func):
+        """Generator version of do(), for use with `result = yield from`.
+
+        The leader yields the items of the generator func() as they come, and
+        that generator's return value is the result. Followers yield nothing
+        and only receive the result.
+        """
+        while True:
+            call, leader = self.join(key)
+            if leader:
+                break
+            if self.follow(call):
+                return call.result
+        
+        try:
+            call.result = yield from func()
+        except Exception as e:
+            call.error = e
+            raise
+        except BaseException:
+            call.cancelled = True
+            raise
+        finally:
+            self.finish(key, call)
+        return call.result
+
+    def stats(self):
+        with self.lock:
+            return {
+                'in_flight': len(self.calls),
+                'executed': self.executed,
+                'coalesced': self.coalesced
+            }
+
+generation_flights = SingleFlight()
+
+def current_user_key():
+    """Key requests are scheduled fairly by: the logged-in user, else the client address"""
+    if has_request_context():
+        return session.get('user_id') or request.remote_addr
+    return None
+
+def resolve_model(model=None):
+    """Name of the model to use, checked against the installed models when Ollama is reachable"""
     # Use provided model or default to OLLAMA_MODEL
     if model is None:
         model = OLLAMA_MODEL
     
-    # Verify model is available (optional check)
-    try:
-        check_url = OLLAMA_API_URL.replace('/api/chat', '/api/tags')
-        check_response = requests.get(check_url, timeout=5)
-        if check_response.status_code == 200:
-            available_models = check_response.json().get('models', [])
-            model_names = [m.get('name', '') for m in available_models]
-            # Check if exact model name or base model name exists
-            model_base = model.split(':')[0]
-            # Also check for 'latest' tag variations
-            model_variants = [model, model_base, f"{model_base}:latest"]
-            if not any(m in model_names or any(avail.startswith(m.split(':')[0]) for avail in model_names) for m in model_variants):
-                available_list = ', '.join(set([m.split(':')[0] for m in model_names]))
-                raise Exception(f"Model '{model}' not found. Available models: {available_list}. Please run: ollama pull {model}")
-    except requests.exceptions.RequestException:
-        # If we can't check, continue anyway - might be a network issue
-        pass
+    # Verify model is available (optional check - skipped if Ollama can't be reached)
+    installed = model_registry.resolve(model)
+    if installed is False:
+        available_list = ', '.join(model_registry.installed_names())
+        raise Exception(f"Model '{model}' not found. Available models: {available_list}. Please run: ollama pull {model}")
+    return installed or model
+
+# Prompt compaction: the schema is reduced to a catalog of table definitions
+# (no data), and only the tables most relevant to the question are sent
+
+def _search_terms(text):
+    """Lowercase word stems of identifiers and questions, splitting snake_case and camelCase"""
+    text = re.sub(r'([a-z])([A-Z])', r'\1 \2', text).lower()
+    terms = []
+    for word in re.findall(r'[a-z0-9]+', text):
+        if len(word) > 4 and word.endswith('ies'):
+            word = word[:-3] + 'y'
+        elif len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+class SchemaCatalog:
+    """Compact description of the tables in a schema with a BM25 index over their names.
+
+    Tables are parsed once by running only the translated CREATE TABLE
+    statements against an empty database, so data rows are never loaded.
+    A workspace is already a SQLite database, so its file is read directly.
+    """
+
+    def __init__(self, tables):
+        self.tables = tables  # list of (name, compact definition line)
+        self.references = {}  # table -> tables it has foreign keys to
+        self.doc_terms = []
+        self.doc_freq = {}
+        self.avg_length = 0
+        
+    @classmethod
+    def from_schema(cls, schema_content):
+        if isinstance(schema_content, Workspace):
+            # Its DDL is SQLite already; running it through the MySQL translator would mangle it
+            conn = open_workspace_db(schema_content)
+        else:
+            conn = sqlite3.connect(':memory:')
+            for statement in iter_sqlite_statements(schema_content):
+                if _CREATE_TABLE.match(statement):
+                    try:
+                        conn.execute(statement)
+                    except sqlite3.Error:
+                        continue
+        tables = []
+        references = {}
+        terms = []
+        names = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY rowid")]
+        for name in names:
+            columns = []
+            column_names = []
+            for _, column, col_type, _, _, pk in conn.execute(f'PRAGMA table_info({_quote_identifier(name)})'):
+                columns.append(f"{column} {col_type}{' PK' if pk else ''}".strip())
+                column_names.append(column)
+            foreign_keys = conn.execute(f'PRAGMA foreign_key_list({_quote_identifier(name)})').fetchall()
+            for fk in foreign_keys:
+                columns.append(f"FK {fk[3]} -> {fk[2]}.{fk[4] or fk[3]}")
+            references[name] = [fk[2] for fk in foreign_keys]
+            tables.append((name, f"{name}({', '.join(columns)})"))
+            # Table name terms count twice: a question naming the table is the strongest signal
+            terms.append(_search_terms(name) * 2 + _search_terms(' '.join(column_names)))
+        conn.close()
+        
+        catalog = cls(tables)
+        catalog.references = references
+        catalog.doc_terms = [Counter(doc) for doc in terms]
+        for doc in catalog.doc_terms:
+            for term in doc:
+                catalog.doc_freq[term] = catalog.doc_freq.get(term, 0) + 1
+        catalog.avg_length = sum(len(doc) for doc in terms) / len(terms) if terms else 0
+        return catalog
+
+    def scores(self, question, k1=1.5, b=0.75):
+        """BM25 score of each table for the question"""
+        count = len(self.tables)
+        result = []
+        question_terms = set(_search_terms(question))
+        for doc in self.doc_terms:
+            length = sum(doc.values())
+            score = 0.0
+            for term in question_terms:
+                tf = doc.get(term)
+                if not tf:
+                    continue
+                df = self.doc_freq[term]
+                idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+                score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / (self.avg_length or 1)))
+            result.append(score)
+        return result
+
+    def render(self, question, token_budget, max_tables):
+        """Definitions of the most relevant tables that fit in `token_budget` (~4 chars per token)"""
+        scores = self.scores(question)
+        order = sorted(range(len(self.tables)), key=lambda i: -scores[i])
+        index = {name: i for i, (name, _) in enumerate(self.tables)}
+        # Tables referenced by a relevant table are needed for its joins; rank them next
+        ranked = []
+        for i in order:
+            if i not in ranked:
+                ranked.append(i)
+            if scores[i] > 0:
+                for ref in self.references.get(self.tables[i][0], []):
+                    if ref in index and index[ref] not in ranked:
+                        ranked.append(index[ref])
+        chosen = []
+        used = 0
+        for i in ranked:
+            cost = len(self.tables[i][1]) // 4 + 1
+            if chosen and (used + cost > token_budget or len(chosen) >= max_tables):
+                continue
+            chosen.append(i)
+            used += cost
+        # Keep the schema's own table order so related tables stay together
+        return '\n'.join(self.tables[i][1] for i in sorted(chosen))
+
+schema_catalogs = OrderedDict()  # schema hash -> SchemaCatalog, LRU
+schema_catalogs_lock = threading.Lock()
+
+def get_schema_catalog(schema_content):
+    """Parsed catalog for a schema, cached per schema hash"""
+    key = schema_hash(schema_content)
+    with schema_catalogs_lock:
+        catalog = schema_catalogs.get(key)
+        if catalog is not None:
+            schema_catalogs.move_to_end(key)
+            return catalog
+    catalog = SchemaCatalog.from_schema(schema_content)
+    with schema_catalogs_lock:
+        schema_catalogs[key] = catalog
+        while len(schema_catalogs) > SCHEMA_CATALOG_CACHE_SIZE:
+            schema_catalogs.popitem(last=False)
+    return catalog
+
+def build_schema_prompt(natural_language_query, schema_content):
+    """Schema text for the prompt: relevant table definitions, or the truncated raw schema"""
+    catalog = get_schema_catalog(schema_content)
+    if catalog.tables:
+        return catalog.render(natural_language_query, PROMPT_SCHEMA_TOKENS, PROMPT_MAX_TABLES)
     
+    # No CREATE TABLE statements found - fall back to the raw text
     # Limit schema size to prevent extremely long prompts that slow down generation
     max_schema_length = 2000  # characters
     if len(schema_content) > max_schema_length:
-        schema_content_truncated = schema_content[:max_schema_length] + "\n... (schema truncated)"
-    else:
-        schema_content_truncated = schema_content
-    
+        return schema_content[:max_schema_length] + "\n... (schema truncated)"
+    return schema_content
+
+def build_generation_payload(natural_language_query, schema_content, model):
+    """Ollama /api/chat request body for a natural language question"""
     # Very concise prompt for faster generation
     prompt = f"""Schema:
-{schema_content_truncated}
+{build_schema_prompt(natural_language_query, schema_content)}
 
 Query: {natural_language_query}
 
 SQL:"""
 
-    headers = {
-        'Content-Type': 'application/json'
-    }
-    
-    payload = {
+    return {
         'model': model,
         'messages': [
             {
@@ -247,77 +1757,997 @@ SQL:"""
             }
         ],
         'stream': False,
+        **({'keep_alive': OLLAMA_KEEP_ALIVE} if OLLAMA_KEEP_ALIVE is not None else {}),
         'options': {
             'temperature': 0.1,  # Lower temperature for faster, more deterministic outputs
             'num_predict': 500   # Limit response length to speed up generation
         }
     }
+
+def build_fallback_payload(payload):
+    """Equivalent /api/generate request body for servers without /api/chat"""
+    return {
+        'model': payload['model'],
+        'prompt': f"{payload['messages'][0]['content']}\n\n{payload['messages'][1]['content']}",
+        'stream': payload['stream'],
+        **({'keep_alive': payload['keep_alive']} if 'keep_alive' in payload else {}),
+        # Keep the caller's sampling options (temperature, seed)
+        'options': dict(payload['options'], num_predict=300)
+    }
+
+def post_generation(payload, stream=False):
+    """POST a generation request, preferring /api/chat and falling back to /api/generate"""
+    # Try /api/chat endpoint first (newer Ollama versions), unless this server
+    # is already known not to have it
+    # Read timeout (OLLAMA_READ_TIMEOUT) is generous - local models can take longer
+    response = None
+    if model_registry.chat_supported is not False:
+        response = ollama_client.post('/api/chat', payload, stream=stream)
+        if response.status_code == 200:
+            model_registry.chat_supported = True
+        elif response.status_code == 404 and 'model' not in response.text.lower():
+            # A bare 404 (not "model not found") means /api/chat doesn't exist
+            model_registry.chat_supported = False
+    
+    # If /api/chat fails, try /api/generate as fallback (older Ollama versions)
+    if response is None or response.status_code == 500 or response.status_code == 404:
+        if response is not None:
+            response.close()
+        # Try the /api/generate endpoint with simpler format
+        response = ollama_client.post('/api/generate', build_fallback_payload(payload), stream=stream)
     
+    check_ollama_response(response)
+    return response
+
+def check_ollama_response(response):
+    """Raise a descriptive exception for a failed Ollama response"""
+    if response.status_code == 200:
+        return
+    # Get more details about the error if request failed
+    error_detail = ""
     try:
-        # Try /api/chat endpoint first (newer Ollama versions)
-        # Increased timeout for slower systems - local models can take longer
-        response = requests.post(OLLAMA_API_URL, headers=headers, json=payload, timeout=300)
-        
-        # If /api/chat fails, try /api/generate as fallback (older Ollama versions)
-        if response.status_code == 500 or response.status_code == 404:
-            # Try the /api/generate endpoint with simpler format
-            generate_url = OLLAMA_API_URL.replace('/api/chat', '/api/generate')
-            generate_payload = {
-                'model': model,
-                'prompt': f"{payload['messages'][0]['content']}\n\n{payload['messages'][1]['content']}",
-                'stream': False,
-                'options': {
-                    'temperature': 0.1,
-                    'num_predict': 300
-                }
-            }
-            response = requests.post(generate_url, headers=headers, json=generate_payload, timeout=300)
-        
-        # Get more details about the error if request failed
-        if response.status_code != 200:
-            error_detail = ""
+        error_data = response.json()
+        error_detail = f" - {error_data}"
+        # Check for model not found errors
+        if 'error' in error_data and ('not found' in error_data['error'].lower() or response.status_code == 404):
+            error_msg = error_data['error']
+            raise Exception(f"Model not found: {error_msg}. Available models: Run 'ollama list' to see installed models. To install a smaller model, try: 'ollama pull llama3.2:3b' or 'ollama pull mistral:7b'")
+        # Check for memory-related errors
+        elif 'error' in error_data and 'memory' in error_data['error'].lower():
+            error_msg = error_data['error']
+            raise Exception(f"Insufficient memory: {error_msg}. Try using a smaller model. Run 'ollama pull llama3.2:3b' (requires ~2GB) or 'ollama pull mistral:7b' (requires ~4GB) to download smaller versions.")
+    except Exception as e:
+        if "Model not found" in str(e) or "Insufficient memory" in str(e):
+            raise e
+        error_detail = f" - {error_data if 'error_data' in locals() else response.text[:200]}"
+    if not error_detail:
+        error_detail = f" - {response.text[:200]}"
+    raise Exception(f"Ollama API returned status {response.status_code}{error_detail}")
+
+def response_text(data):
+    """Generated text from an Ollama /api/chat or /api/generate response (or stream chunk)"""
+    # Ollama /api/chat response format: {"message": {"content": "..."}}
+    if 'message' in data and 'content' in data['message']:
+        return data['message']['content']
+    # Ollama /api/generate response format: {"response": "..."}
+    if 'response' in data:
+        return data['response']
+    return None
+
+def clean_generated_sql(generated_sql):
+    """Clean up SQL - remove markdown code blocks if present"""
+    generated_sql = re.sub(r'```sql\n?', '', generated_sql)
+    generated_sql = re.sub(r'```\n?', '', generated_sql)
+    return generated_sql.strip()
+
+def ollama_exception(e):
+    """Map a requests exception from the Ollama client to a user-facing error"""
+    if isinstance(e, requests.exceptions.ConnectionError):
+        return Exception("Cannot connect to Ollama. Please make sure Ollama is running on your machine. Start it with: ollama serve")
+    return Exception(f"API request failed: {str(e)}")
+
+def generate_sql_with_ai(natural_language_query, schema_content, model=None, user=None):
+    """Generate SQL query using Ollama API (local)"""
+    model = resolve_model(model)
+    with stage_timer('prompt'):
+        payload = build_generation_payload(natural_language_query, schema_content, model)
+    
+    cached_sql = generation_cache.get(natural_language_query, schema_content, model, payload['options'])
+    if cached_sql is not None:
+        return cached_sql
+    
+    if user is None:
+        user = current_user_key()
+    
+    def generate():
+        # Wait for a turn at the model (raises SchedulerBusy if the queue is full)
+        with llm_scheduler.slot(user):
             try:
-                error_data = response.json()
-                error_detail = f" - {error_data}"
-                # Check for model not found errors
-                if 'error' in error_data and ('not found' in error_data['error'].lower() or response.status_code == 404):
-                    error_msg = error_data['error']
-                    raise Exception(f"Model not found: {error_msg}. Available models: Run 'ollama list' to see installed models. To install a smaller model, try: 'ollama pull llama3.2:3b' or 'ollama pull mistral:7b'")
-                # Check for memory-related errors
-                elif 'error' in error_data and 'memory' in error_data['error'].lower():
-                    error_msg = error_data['error']
-                    raise Exception(f"Insufficient memory: {error_msg}. Try using a smaller model. Run 'ollama pull llama3.2:3b' (requires ~2GB) or 'ollama pull mistral:7b' (requires ~4GB) to download smaller versions.")
+                with stage_timer('inference'):
+                    response = post_generation(payload)
+                    data = response.json()
+                record_ollama_stats(data, model)
+                
+                generated_text = response_text(data)
+                if generated_text is None:
+                    raise Exception(f"No SQL generated from API response. Response: {data}")
+                generated_sql = clean_generated_sql(generated_text)
+                generation_cache.put(natural_language_query, schema_content, model, payload['options'], generated_sql)
+                return generated_sql
+            except requests.exceptions.RequestException as e:
+                raise ollama_exception(e)
             except Exception as e:
-                if "Model not found" in str(e) or "Insufficient memory" in str(e):
-                    raise e
-                error_detail = f" - {error_data if 'error_data' in locals() else response.text[:200]}"
-            if not error_detail:
-                error_detail = f" - {response.text[:200]}"
-            raise Exception(f"Ollama API returned status {response.status_code}{error_detail}")
-        
-        response.raise_for_status()
-        data = response.json()
-        
-        # Ollama /api/chat response format: {"message": {"content": "..."}}
-        if 'message' in data and 'content' in data['message']:
-            generated_sql = data['message']['content'].strip()
-        # Ollama /api/generate response format: {"response": "..."}
-        elif 'response' in data:
-            generated_sql = data['response'].strip()
-        else:
-            raise Exception(f"No SQL generated from API response. Response: {data}")
+                raise Exception(f"Error generating SQL: {str(e)}")
+    
+    # Identical requests already in flight share one generation
+    scope = generation_cache.make_scope(schema_content, model, payload['options'])
+    flight_key = generation_cache.make_key(scope, normalize_query(natural_language_query))
+    return generation_flights.do(flight_key, generate)
+
+# Incomplete markdown fence at the end of a partial completion, held back while streaming
+_PARTIAL_FENCE = re.compile(r'`{1,3}(?:s(?:q(?:l)?)?)?$')
+
+def sql_statement_end(text):
+    """Index just past the first ';' outside string literals, or None"""
+    quote = None
+    for i, ch in enumerate(text):
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"', '`'):
+            quote = ch
+        elif ch == ';':
+            return i + 1
+    return None
+
+def iter_sql_tokens(payload, model, user=None, cancelled=None):
+    """Stream one generation, yielding pieces of the cleaned SQL as they arrive.
+
+    Markdown fences are stripped on the fly, and generation is stopped as soon
+    as a complete statement (terminated by ';') is produced. Setting the
+    `cancelled` event (with llm_scheduler.cancel) abandons the generation,
+    whether it is still queued for the model or already streaming.
+    """
+    # Wait for a turn at the model (raises SchedulerBusy if the queue is full)
+    with llm_scheduler.slot(user, cancelled) as admitted:
+        # Cancelled while queued, or just as the slot came up
+        if not admitted or (cancelled is not None and cancelled.is_set()):
+            return
+        payload = dict(payload, stream=True)
+        start = time.perf_counter()
+        try:
+            response = post_generation(payload, stream=True)
+        except requests.exceptions.RequestException as e:
+            raise ollama_exception(e)
+        except Exception as e:
+            raise Exception(f"Error generating SQL: {str(e)}")
+    
+        raw = ''
+        emitted = ''
+        try:
+            for line in response.iter_lines(chunk_size=None):
+                if cancelled is not None and cancelled.is_set():
+                    break
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get('error'):
+                    raise Exception(f"Error generating SQL: {data['error']}")
+                raw += response_text(data) or ''
+                # Never emit a fence that is still arriving, e.g. a trailing '``'
+                visible = raw if data.get('done') else _PARTIAL_FENCE.sub('', raw)
+                cleaned = re.sub(r'```(?:sql)?\n?', '', visible).lstrip()
+                end = sql_statement_end(cleaned)
+                if end is not None:
+                    cleaned = cleaned[:end]
+                if data.get('done'):
+                    record_ollama_stats(data, model)
+                if cleaned.startswith(emitted) and len(cleaned) > len(emitted):
+                    if not emitted:
+                        record_stage('first_token', time.perf_counter() - start)
+                    yield cleaned[len(emitted):]
+                    emitted = cleaned
+                if end is not None or data.get('done'):
+                    break
+        except requests.exceptions.RequestException as e:
+            raise ollama_exception(e)
+        finally:
+            # Closing the connection early makes Ollama stop generating
+            response.close()
+            record_stage('inference', time.perf_counter() - start)
+
+def stream_sql_with_ai(natural_language_query, schema_content, model=None, user=None):
+    """Generate SQL with Ollama's streaming API.
+
+    Yields ('token', text) pieces of the cleaned SQL as they arrive (see
+    iter_sql_tokens), then ('done', sql).
+    """
+    model = resolve_model(model)
+    with stage_timer('prompt'):
+        payload = build_generation_payload(natural_language_query, schema_content, model)
+    
+    cached_sql = generation_cache.get(natural_language_query, schema_content, model, payload['options'])
+    if cached_sql is not None:
+        yield 'token', cached_sql
+        yield 'done', cached_sql
+        return
+    
+    streamed = []
+    
+    def generate():
+        emitted = ''
+        for token in iter_sql_tokens(payload, model, user):
+            emitted += token
+            streamed.append(token)
+            yield 'token', token
         
-        # Clean up SQL - remove markdown code blocks if present
-        generated_sql = re.sub(r'```sql\n?', '', generated_sql)
-        generated_sql = re.sub(r'```\n?', '', generated_sql)
-        generated_sql = generated_sql.strip()
+        generated_sql = emitted.strip()
+        if not generated_sql:
+            raise Exception("Error generating SQL: No SQL generated from API response")
+        generation_cache.put(natural_language_query, schema_content, model, payload['options'], generated_sql)
         return generated_sql
-    except requests.exceptions.ConnectionError as e:
-        raise Exception("Cannot connect to Ollama. Please make sure Ollama is running on your machine. Start it with: ollama serve")
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"API request failed: {str(e)}")
+    
+    # Identical requests already in flight (streamed or not) share one generation;
+    # requests that joined another one receive its SQL in one piece when it is done
+    scope = generation_cache.make_scope(schema_content, model, payload['options'])
+    flight_key = generation_cache.make_key(scope, normalize_query(natural_language_query))
+    generated_sql = yield from generation_flights.stream(flight_key, generate)
+    if not streamed:
+        yield 'token', generated_sql
+    yield 'done', generated_sql
+
+def generate_sql_candidates(natural_language_query, schema_content, model=None, candidates=2, user=None):
+    """Generate several SQL candidates in parallel and return the first one that validates.
+
+    Candidate 0 uses the normal sampling options; the others get a higher
+    temperature and their own seed. Each candidate is streamed from Ollama and
+    validated (validate_generated_sql) as soon as its statement is complete;
+    the first valid one wins, and the rest are cancelled, which closes their
+    streams or drops them from the scheduler queue. If none validates, the
+    lowest-numbered candidate that produced SQL is returned.
+
+    Returns {'sql', 'valid', 'candidate', 'attempts'}, where attempts lists the
+    candidates that finished before the winner with their errors.
+    """
+    model = resolve_model(model)
+    with stage_timer('prompt'):
+        payload = build_generation_payload(natural_language_query, schema_content, model)
+    
+    cached_sql = generation_cache.get(natural_language_query, schema_content, model, payload['options'])
+    if cached_sql is not None and validate_generated_sql(cached_sql, schema_content) is None:
+        return {'sql': cached_sql, 'valid': True, 'candidate': None, 'attempts': []}
+    
+    if user is None:
+        user = current_user_key()
+    cancelled = threading.Event()
+    failures = {}  # candidate -> exception raised while generating
+    
+    def run(index):
+        options = dict(payload['options'])
+        if index:
+            options['temperature'] = round(min(1.0, options['temperature'] + 0.3 * index), 2)
+            options['seed'] = index
+        attempt = {'candidate': index, 'temperature': options['temperature']}
+        try:
+            sql = ''.join(iter_sql_tokens(dict(payload, options=options), model, user, cancelled)).strip()
+        except Exception as e:
+            failures[index] = e
+            attempt['error'] = str(e)
+            return attempt
+        if cancelled.is_set():
+            attempt['error'] = 'Cancelled'
+            return attempt
+        if not sql:
+            attempt['error'] = 'No SQL generated from API response'
+            return attempt
+        attempt['sql'] = sql
+        with stage_timer('candidate_validation'):
+            error = validate_generated_sql(sql, schema_content)
+        if error is not None:
+            attempt['error'] = error
+        return attempt
+    
+    attempts = []
+    executor = ThreadPoolExecutor(max_workers=candidates)
+    try:
+        futures = [executor.submit(contextvars.copy_context().run, run, i) for i in range(candidates)]
+        for future in as_completed(futures):
+            attempt = future.result()
+            attempts.append(attempt)
+            if 'error' not in attempt:
+                metrics.inc('generation_candidates_total', outcome='valid')
+                if len(attempts) < candidates:
+                    metrics.inc('generation_candidates_total', candidates - len(attempts), outcome='cancelled')
+                generation_cache.put(natural_language_query, schema_content, model, payload['options'], attempt['sql'])
+                return {'sql': attempt['sql'], 'valid': True, 'candidate': attempt['candidate'], 'attempts': attempts}
+            metrics.inc('generation_candidates_total', outcome='invalid' if 'sql' in attempt else 'failed')
+    finally:
+        # Stop the losing candidates: open streams are closed, queued ones leave the queue
+        llm_scheduler.cancel(cancelled)
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    generated = sorted((a for a in attempts if 'sql' in a), key=lambda a: a['candidate'])
+    if not generated:
+        # Nothing came back at all (e.g. Ollama is down or the queue is full)
+        if failures:
+            raise failures[min(failures)]
+        raise Exception("Error generating SQL: No SQL generated from API response")
+    return {'sql': generated[0]['sql'], 'valid': False, 'candidate': generated[0]['candidate'], 'attempts': attempts}
+
+def iter_batch_generation(questions, schema_content, model=None, workers=None, user=None):
+    """Generate SQL for many questions against one schema.
+
+    The schema catalog and model are resolved once, then questions are sent to
+    the model from a pool of `workers` threads. Yields one result dict per
+    question, in completion order, with its index and elapsed time.
+    """
+    model = resolve_model(model)
+    get_schema_catalog(schema_content)
+    workers = max(1, min(workers or BATCH_WORKERS, BATCH_WORKERS, len(questions)))
+    
+    def run(index, question):
+        start = time.perf_counter()
+        result = {'index': index, 'query': question}
+        try:
+            result['sql'] = generate_sql_with_ai(question, schema_content, model, user=user)
+        except Exception as e:
+            result['error'] = str(e)
+        result['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        return result
+    
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        # Each task runs in a copy of the caller's context so stage timings keep its trace ID
+        futures = [executor.submit(contextvars.copy_context().run, run, i, q) for i, q in enumerate(questions)]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # Stop queued questions if the consumer goes away early
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# Query guardrails: generated SQL can be a cartesian join or a runaway recursive
+# CTE, so every user query runs under time, instruction and memory limits
+
+class QueryLimitExceeded(Exception):
+    """A query was aborted by a resource limit; `limit` names which one"""
+
+    def __init__(self, message, limit):
+        super().__init__(message)
+        self.limit = limit
+
+query_limit_trips = Counter()  # limit name -> times tripped
+query_limit_lock = threading.Lock()
+
+def record_query_limit(limit):
+    with query_limit_lock:
+        query_limit_trips[limit] += 1
+
+class QueryGuard:
+    """Enforces per-query resource limits on a connection.
+
+    A progress handler, called every QUERY_PROGRESS_INTERVAL VM instructions,
+    aborts the statement once the wall-clock timeout or instruction budget is
+    used up. The page cache and database growth are capped so that DML or
+    temp tables can't grow the in-memory database past `max_memory` bytes.
+    """
+
+    def __init__(self, conn, timeout, max_instructions, max_memory):
+        self.timeout = timeout
+        self.max_instructions = max_instructions
+        self.tripped = None
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+        conn.execute(f'PRAGMA cache_size = -{max(1, max_memory // 1024)}')
+        conn.execute(f'PRAGMA max_page_count = {page_count + max(1, max_memory // page_size)}')
+        conn.execute('PRAGMA temp_store = FILE')
+        conn.set_progress_handler(self.check, QUERY_PROGRESS_INTERVAL)
+        self.start()
+
+    def start(self):
+        """Reset the budgets, e.g. before fetching the next page of a cursor"""
+        self.deadline = time.monotonic() + self.timeout
+        self.instructions = 0
+
+    def check(self):
+        self.instructions += QUERY_PROGRESS_INTERVAL
+        if self.instructions > self.max_instructions:
+            self.tripped = 'instructions'
+            return 1
+        if time.monotonic() > self.deadline:
+            self.tripped = 'timeout'
+            return 1
+        return 0
+
+    def translate(self, error):
+        """Exception to report for a SQLite error raised under this guard"""
+        if self.tripped == 'timeout':
+            limit, message = 'timeout', f'Query exceeded the {self.timeout:g} second time limit'
+        elif self.tripped == 'instructions':
+            limit, message = 'instructions', 'Query exceeded the execution step limit'
+        elif isinstance(error, sqlite3.OperationalError) and 'full' in str(error).lower():
+            limit, message = 'memory', 'Query exceeded the memory limit'
+        else:
+            return error
+        self.tripped = None
+        record_query_limit(limit)
+        return QueryLimitExceeded(message, limit)
+
+def get_guarded_connection(schema_content, read_only=False):
+    """Private database copy (or read-only workspace file) for running a user query, with resource limits applied"""
+    conn = get_db_connection(schema_content, read_only)
+    guard = QueryGuard(conn, EXECUTE_TIMEOUT, EXECUTE_MAX_INSTRUCTIONS, EXECUTE_MAX_MEMORY_BYTES)
+    return conn, guard
+
+def rows_affected(conn, cursor):
+    """Rows changed by a statement on a fresh private copy.
+
+    cursor.rowcount is -1 for DML the sqlite3 module doesn't recognize by its
+    first keyword (e.g. `WITH ... DELETE`); the copy starts with no changes,
+    so its change counter gives the same number.
+    """
+    return cursor.rowcount if cursor.rowcount >= 0 else conn.total_changes
+
+def query_limit_response(e):
+    return jsonify({'error': str(e), 'limit': e.limit}), 400
+
+# Statement cache: classification, plans and small results of repeated queries
+
+# Authorizer actions a statement may ask for and still be read-only
+_READ_ONLY_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+# Functions whose value changes between runs of the same query
+_VOLATILE_FUNCTIONS = {'random', 'randomblob', 'changes', 'total_changes', 'last_insert_rowid',
+                       'date', 'time', 'datetime', 'julianday', 'unixepoch', 'strftime', 'timediff',
+                       'current_date', 'current_time', 'current_timestamp'}
+
+def normalize_sql(sql_query):
+    """Cache key form of a statement: surrounding whitespace and trailing semicolons removed"""
+    return sql_query.strip().rstrip(';').rstrip()
+
+def classify_statement(conn, sql_query):
+    """(read_only, deterministic) for a statement, without running it.
+
+    The statement is compiled under EXPLAIN with an authorizer recording every
+    action it asks SQLite for; anything beyond reads, selects and function calls
+    is a write. This is what sqlite3_stmt_readonly() reports, and unlike a
+    keyword check it tells `WITH ... SELECT` from `WITH ... DELETE`.
+    """
+    actions = set()
+    functions = set()
+
+    def authorizer(action, arg1, arg2, db_name, source):
+        actions.add(action)
+        if action == sqlite3.SQLITE_FUNCTION and arg2:
+            functions.add(arg2.lower())
+        return sqlite3.SQLITE_OK
+
+    conn.set_authorizer(authorizer)
+    try:
+        conn.execute('EXPLAIN ' + sql_query)
+    finally:
+        conn.set_authorizer(None)
+    read_only = actions <= _READ_ONLY_ACTIONS
+    return read_only, read_only and not functions & _VOLATILE_FUNCTIONS
+
+class StatementCache:
+    """LRU cache of what is known about a statement on a schema.
+
+    Entries are keyed by schema hash and normalized SQL and hold the statement's
+    classification, its result columns, its plan analysis and, for small
+    deterministic reads, its rows. DML only ever runs on private database
+    copies, so cached results stay valid until the schema's cached database
+    itself changes (indexes created from a plan analysis); `invalidate` drops
+    the schema's entries then.
+    """
+
+    def __init__(self, max_entries, max_result_rows):
+        self.max_entries = max_entries
+        self.max_result_rows = max_result_rows
+        self.entries = OrderedDict()  # (schema hash, sql) -> entry dict
+        self.hits = 0
+        self.misses = 0
+        self.result_hits = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, sql_query, schema_content):
+        """Return the entry for a statement, classifying it on the cached schema database on a miss"""
+        key = (schema_hash(schema_content), normalize_sql(sql_query))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                if entry['rows'] is not None:
+                    self.result_hits += 1
+                return entry
+            self.misses += 1
+
+        entry = {'read_only': False, 'deterministic': False, 'columns': None, 'rows': None, 'analysis': None}
+        try:
+            entry['read_only'], entry['deterministic'] = schema_cache.with_template(
+                schema_content, lambda conn: classify_statement(conn, key[1]))
+        except sqlite3.Error:
+            # Invalid SQL: not cached, so running it reports the error as usual
+            return entry
+        with self.lock:
+            self.entries[key] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def store_result(self, entry, columns, rows):
+        """Keep a read-only statement's complete result if it is deterministic and small"""
+        entry['columns'] = columns
+        if entry['deterministic'] and len(rows) <= self.max_result_rows:
+            entry['rows'] = [tuple(row) for row in rows]
+
+    def invalidate(self, schema_content):
+        """Drop every entry for a schema whose cached database has changed"""
+        key = schema_hash(schema_content)
+        with self.lock:
+            for entry_key in [k for k in self.entries if k[0] == key]:
+                del self.entries[entry_key]
+            self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'cached_results': sum(1 for entry in self.entries.values() if entry['rows'] is not None),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'result_hits': self.result_hits,
+                'invalidations': self.invalidations
+            }
+
+statement_cache = StatementCache(STATEMENT_CACHE_SIZE, STATEMENT_RESULT_MAX_ROWS)
+
+# Pre-flight plan analysis of generated SQL with EXPLAIN QUERY PLAN
+
+_PLAN_STEP = re.compile(r'(SCAN|SEARCH)\s+(?:TABLE\s+)?(\S+)(?:\s+AS\s+(\S+))?(.*)')
+_AUTOMATIC_INDEX = re.compile(r'AUTOMATIC (?:PARTIAL )?(?:COVERING )?INDEX \((.*)\)')
+_TABLE_REFERENCE = re.compile(
+    r'(?:\bFROM|\bJOIN|,)\s*([\w."]+)(?:\s+(?:AS\s+)?(?!(?:FROM|WHERE|ON|USING|JOIN|LEFT|RIGHT|INNER|OUTER|CROSS|'
+    r'NATURAL|GROUP|ORDER|LIMIT|HAVING|UNION|EXCEPT|INTERSECT|WINDOW)\b)(\w+))?', re.IGNORECASE)
+# Rows SQLite itself assumes an index equality lookup returns when there are no statistics
+_ROWS_PER_INDEX_LOOKUP = 10
+
+table_row_counts = OrderedDict()  # schema hash -> {table: rows}, LRU
+table_row_counts_lock = threading.Lock()
+
+def get_table_row_counts(schema_content, conn):
+    """Row count of each table in a schema's database, cached per schema"""
+    key = schema_hash(schema_content)
+    with table_row_counts_lock:
+        counts = table_row_counts.get(key)
+        if counts is not None:
+            table_row_counts.move_to_end(key)
+            return counts
+    counts = {}
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall():
+        counts[name.lower()] = conn.execute(f'SELECT count(*) FROM "{name}"').fetchone()[0]
+    with table_row_counts_lock:
+        table_row_counts[key] = counts
+        while len(table_row_counts) > SCHEMA_CATALOG_CACHE_SIZE:
+            table_row_counts.popitem(last=False)
+    return counts
+
+def _analyze_plan(conn, sql_query, schema_content, create_indexes):
+    counts = get_table_row_counts(schema_content, conn)
+    aliases = {}
+    for table, alias in _TABLE_REFERENCE.findall(sql_query):
+        table = table.strip('"').lower()
+        aliases[table] = table
+        if alias:
+            aliases[alias.lower()] = table
+    
+    plan = conn.execute('EXPLAIN QUERY PLAN ' + sql_query).fetchall()
+    warnings = []
+    suggestions = []
+    # Loops with the same parent are nested inside each other, in plan order
+    outer_rows = {}
+    cost = 0.0
+    for row in plan:
+        parent, detail = row[1], row[3]
+        outer = outer_rows.get(parent, 1)
+        step = _PLAN_STEP.match(detail)
+        if step is None:
+            if 'TEMP B-TREE' in detail:
+                cost += outer * math.log2(outer + 1)
+            continue
+        kind, name, _, rest = step.groups()
+        table = aliases.get(name.lower(), name.lower())
+        rows = counts.get(table, EXPLAIN_DEFAULT_ROWS)
+        if kind == 'SCAN':
+            cost += outer * rows
+            outer_rows[parent] = outer * max(rows, 1)
+            if rows >= EXPLAIN_LARGE_TABLE_ROWS:
+                warnings.append(f"Full scan of {table} ({rows} rows)")
+            continue
+        
+        if 'PRIMARY KEY' in rest and '=' in rest:
+            matched = 1
+        elif '=' in rest and '<' not in rest and '>' not in rest:
+            matched = min(rows, _ROWS_PER_INDEX_LOOKUP)
+        else:
+            matched = max(1, rows // 4)
+        cost += outer * (math.log2(rows + 1) + matched)
+        outer_rows[parent] = outer * matched
+        automatic = _AUTOMATIC_INDEX.search(rest)
+        if automatic:
+            columns = re.findall(r'(\w+)\s*[=<>]', automatic.group(1))
+            warnings.append(f"No index on {table}({', '.join(columns)}); SQLite builds a temporary index on every run")
+            index_name = f"auto_{table}_{'_'.join(columns)}"
+            suggestions.append(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table}" ({", ".join(columns)})')
+    
+    analysis = {
+        'plan': [row[3] for row in plan],
+        'estimated_cost': round(cost),
+        'warnings': warnings,
+        'suggested_indexes': suggestions
+    }
+    if create_indexes and suggestions:
+        for statement in suggestions:
+            conn.execute(statement)
+        conn.commit()
+        analysis['created_indexes'] = suggestions
+    return analysis
+
+def analyze_query_plan(sql_query, schema_content, create_indexes=None):
+    """Plan, cost estimate, warnings and index suggestions for a query, without running it.
+
+    Uses EXPLAIN QUERY PLAN on the cached schema database. Cost is a rough
+    count of rows visited, from table sizes and SQLite's default assumptions.
+    With `create_indexes` (default EXPLAIN_AUTO_INDEX) suggested indexes are
+    created on the cached database, so later executions use them.
+    """
+    if create_indexes is None:
+        create_indexes = EXPLAIN_AUTO_INDEX
+    if isinstance(schema_content, Workspace):
+        # Workspace files are opened read-only
+        create_indexes = False
+    statement = statement_cache.lookup(sql_query, schema_content)
+    analysis = statement['analysis']
+    if analysis is not None and not (create_indexes and analysis['suggested_indexes']):
+        return analysis
+    try:
+        with stage_timer('plan_analysis'):
+            analysis = schema_cache.with_template(
+                schema_content, lambda conn: _analyze_plan(conn, sql_query, schema_content, create_indexes))
     except Exception as e:
-        raise Exception(f"Error generating SQL: {str(e)}")
+        return {'error': str(e)}
+    if analysis.get('created_indexes'):
+        # New indexes change the plans (and cost) of every statement on this schema
+        statement_cache.invalidate(schema_content)
+    else:
+        statement['analysis'] = analysis
+    return analysis
+
+def validate_generated_sql(sql_query, schema_content):
+    """None if generated SQL is valid on the schema, else the error message.
+
+    The statement must compile (EXPLAIN, via analyze_query_plan), and a
+    read-only statement must also start running: it is dry-run on the
+    schema's read-only snapshot under a short time limit, and its first row
+    fetched. Candidates' dry runs share the snapshot and run concurrently.
+    A query that only hits the limit counts as valid, since it is slow
+    rather than wrong.
+    """
+    analysis = analyze_query_plan(sql_query, schema_content, create_indexes=False)
+    if 'error' in analysis:
+        return analysis['error']
+    if not statement_cache.lookup(sql_query, schema_content)['read_only']:
+        return None
+    conn = schema_cache.snapshot(schema_content)
+    try:
+        return _dry_run(conn, sql_query)
+    finally:
+        conn.close()
+
+def _dry_run(conn, sql_query):
+    """Start a read-only statement and fetch its first row"""
+    deadline = time.monotonic() + GENERATION_DRY_RUN_TIMEOUT
+    timed_out = []
+    
+    def check():
+        if time.monotonic() > deadline:
+            timed_out.append(True)
+            return 1
+        return 0
+    
+    conn.set_progress_handler(check, QUERY_PROGRESS_INTERVAL)
+    try:
+        conn.execute(sql_query).fetchone()
+    except sqlite3.Error as e:
+        return None if timed_out else str(e)
+    return None
+
+# Result sets: streaming and cursor-based pagination for /api/execute-sql
+
+def stream_result_rows(conn, guard, cursor, columns):
+    """NDJSON lines: the columns, then row arrays in chunks, then a summary; closes `conn`"""
+    fetching = 0.0
+    try:
+        yield json.dumps({'columns': columns}) + '\n'
+        sent = 0
+        truncated = False
+        while True:
+            start = time.perf_counter()
+            try:
+                rows = cursor.fetchmany(EXECUTE_STREAM_CHUNK_ROWS)
+            except sqlite3.Error as e:
+                raise guard.translate(e)
+            finally:
+                fetching += time.perf_counter() - start
+            if not rows:
+                break
+            if sent + len(rows) > EXECUTE_MAX_ROWS:
+                rows = rows[:EXECUTE_MAX_ROWS - sent]
+                truncated = True
+            sent += len(rows)
+            yield json.dumps({'rows': [list(row) for row in rows]}) + '\n'
+            if truncated:
+                break
+        if truncated:
+            record_query_limit('rows')
+        yield json.dumps({'done': True, 'row_count': sent, 'truncated': truncated}) + '\n'
+    except QueryLimitExceeded as e:
+        yield json.dumps({'error': str(e), 'limit': e.limit}) + '\n'
+    except Exception as e:
+        yield json.dumps({'error': str(e)}) + '\n'
+    finally:
+        conn.close()
+        record_stage('fetch', fetching)
+
+class ResultCursors:
+    """Open query cursors kept between page requests.
+
+    Each entry holds a private database copy with a partially read cursor, so
+    the next page continues where the last one stopped instead of re-running
+    the query. Entries are LRU-bounded by count and by the bytes of their
+    copies, and closed after `ttl` seconds idle. A page whose cursor was
+    closed re-runs the query and skips to its offset.
+    """
+
+    def __init__(self, max_open, ttl, max_bytes):
+        self.max_open = max_open
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.cursors = OrderedDict()  # id -> entry dict
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def expire(self):
+        """Close idle cursors, and the oldest ones while over a limit (caller holds the lock)"""
+        now = time.monotonic()
+        while self.cursors:
+            cursor_id, entry = next(iter(self.cursors.items()))
+            if (now - entry['used_at'] <= self.ttl and len(self.cursors) <= self.max_open
+                    and self.total_bytes <= self.max_bytes):
+                break
+            self.pop(cursor_id)
+            entry['conn'].close()
+
+    def pop(self, cursor_id):
+        """Remove an entry (caller holds the lock)"""
+        entry = self.cursors.pop(cursor_id)
+        self.total_bytes -= entry['size']
+        return entry
+
+    def take(self, cursor_id, key, offset):
+        """Remove and return the open cursor if it matches the query and position"""
+        with self.lock:
+            self.expire()
+            entry = self.cursors.get(cursor_id)
+            if entry is None or entry['key'] != key or entry['position'] != offset:
+                return None
+            return self.pop(cursor_id)
+
+    def put(self, cursor_id, entry):
+        entry['used_at'] = time.monotonic()
+        with self.lock:
+            self.cursors[cursor_id] = entry
+            self.total_bytes += entry['size']
+            self.expire()
+
+result_cursors = ResultCursors(RESULT_CURSORS_MAX_OPEN, RESULT_CURSORS_TTL, RESULT_CURSORS_MAX_BYTES)
+
+def fetch_result_page(sql_query, schema_content, limit, token=None):
+    """One page of a query's rows as arrays, with a cursor token for the next page"""
+    limit = min(limit, EXECUTE_MAX_ROWS)
+    key = hashlib.sha256(f"{schema_hash(schema_content)}\n{sql_query}".encode('utf-8')).hexdigest()
+    cursor_id, offset = None, 0
+    if token:
+        try:
+            cursor_id, offset = token.rsplit(':', 1)
+            offset = int(offset)
+        except ValueError:
+            raise Exception('Invalid cursor')
+    
+    entry = result_cursors.take(cursor_id, key, offset) if cursor_id else None
+    if entry is None:
+        # No open cursor (first page, expired or evicted): run the query and skip to the offset
+        statement = statement_cache.lookup(sql_query, schema_content)
+        conn, guard = get_guarded_connection(schema_content, statement['read_only'])
+        cursor = conn.cursor()
+        try:
+            try:
+                with stage_timer('execution'):
+                    cursor.execute(sql_query)
+            except sqlite3.Error as e:
+                raise guard.translate(e)
+            if cursor.description is None:
+                conn.commit()
+                changed = rows_affected(conn, cursor)
+                conn.close()
+                return {'success': True, 'columns': [], 'rows': [], 'next_cursor': None,
+                        'results': {'message': 'Query executed successfully', 'rows_affected': changed}}
+            skipped = 0
+            while skipped < offset:
+                try:
+                    chunk = cursor.fetchmany(min(EXECUTE_STREAM_CHUNK_ROWS, offset - skipped))
+                except sqlite3.Error as e:
+                    raise guard.translate(e)
+                if not chunk:
+                    break
+                skipped += len(chunk)
+        except Exception:
+            conn.close()
+            raise
+        # Read-only queries on a workspace use its file rather than an in-memory copy
+        copied = not (isinstance(schema_content, Workspace) and statement['read_only'])
+        entry = {'conn': conn, 'guard': guard, 'cursor': cursor, 'key': key, 'position': offset,
+                 'columns': [description[0] for description in cursor.description],
+                 'size': database_size(conn) if copied else 0}
+        cursor_id = secrets.token_urlsafe(12)
+    else:
+        # Each page gets a fresh time and instruction budget
+        entry['guard'].start()
+    
+    limit = max(0, min(limit, EXECUTE_MAX_ROWS - entry['position']))
+    try:
+        with stage_timer('fetch'):
+            rows = entry['cursor'].fetchmany(limit) if limit else []
+    except sqlite3.Error as e:
+        entry['conn'].close()
+        raise entry['guard'].translate(e)
+    entry['position'] += len(rows)
+    more = len(rows) == limit and limit > 0 and entry['position'] < EXECUTE_MAX_ROWS
+    if more:
+        result_cursors.put(cursor_id, entry)
+    else:
+        entry['conn'].close()
+        if entry['position'] >= EXECUTE_MAX_ROWS and len(rows) == limit:
+            record_query_limit('rows')
+    return {
+        'success': True,
+        'columns': entry['columns'],
+        'rows': [list(row) for row in rows],
+        'next_cursor': f"{cursor_id}:{entry['position']}" if more else None,
+        'truncated': entry['position'] >= EXECUTE_MAX_ROWS and len(rows) == limit
+    }
+
+# Startup: the user database is created before serving, then the model and
+# sample schemas are warmed up in the background
+
+class Warmup:
+    """Background warm-up tasks and their status, reported by the readiness endpoint.
+
+    Each task runs in its own daemon thread. A failed task is started again by
+    start(retry_failed=True) once `retry_interval` seconds have passed.
+    """
+
+    def __init__(self, retry_interval):
+        self.retry_interval = retry_interval
+        self.tasks = OrderedDict()  # name -> task dict
+        self.lock = threading.Lock()
+
+    def add(self, name, func):
+        with self.lock:
+            self.tasks[name] = {'func': func, 'status': 'pending', 'error': None, 'elapsed_ms': None,
+                                'finished_at': None}
+
+    def start(self, retry_failed=False):
+        """Start pending tasks, and failed ones due for a retry"""
+        now = time.monotonic()
+        with self.lock:
+            due = [name for name, task in self.tasks.items()
+                   if task['status'] == 'pending'
+                   or (retry_failed and task['status'] == 'failed' and now - task['finished_at'] >= self.retry_interval)]
+            for name in due:
+                self.tasks[name]['status'] = 'running'
+        for name in due:
+            threading.Thread(target=self.run, args=(name,), name=f'warmup-{name}', daemon=True).start()
+
+    def run(self, name):
+        task = self.tasks[name]
+        start = time.perf_counter()
+        try:
+            task['func']()
+            status, error = 'ready', None
+        except Exception as e:
+            status, error = 'failed', str(e)
+            app.logger.warning('Warm-up of %s failed: %s', name, error)
+        with self.lock:
+            task.update(status=status, error=error, elapsed_ms=round((time.perf_counter() - start) * 1000, 1),
+                        finished_at=time.monotonic())
+
+    def status(self):
+        """(ready, {name: status dict}); ready once every task has succeeded"""
+        with self.lock:
+            tasks = {name: {key: task[key] for key in ('status', 'error', 'elapsed_ms') if task[key] is not None}
+                     for name, task in self.tasks.items()}
+        return all(task['status'] == 'ready' for task in tasks.values()), tasks
+
+warmup = Warmup(WARMUP_RETRY_INTERVAL)
+startup_lock = threading.Lock()
+started = False
+
+def warm_model(model=None):
+    """Have Ollama load the model now, so the first generation doesn't wait for it"""
+    model = resolve_model(model)
+    # A request without a prompt only loads the model
+    payload = {'model': model}
+    if OLLAMA_KEEP_ALIVE is not None:
+        payload['keep_alive'] = OLLAMA_KEEP_ALIVE
+    try:
+        with stage_timer('model_warmup'):
+            response = ollama_client.post('/api/generate', payload)
+            response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        raise ollama_exception(e)
+
+def warm_schema(path):
+    """Materialize a schema file into the schema cache, keyed as if it had been uploaded"""
+    with open(path, 'r', encoding='utf-8') as f:
+        schema_content = f.read().strip()
+    schema_cache.get_template(schema_content)
+    get_schema_catalog(schema_content)
+
+def start_app():
+    """Startup phase, once per process: create the user database and start the warm-up"""
+    global started
+    with startup_lock:
+        if started:
+            return
+        init_db()
+        if WARMUP_ENABLED:
+            warmup.add('model', warm_model)
+            for path in WARMUP_SCHEMAS:
+                warmup.add(f'schema:{os.path.basename(path)}', lambda path=path: warm_schema(path))
+            warmup.start()
+        started = True
+
+def create_app():
+    """Application factory for WSGI servers, e.g. `gunicorn 'app:create_app()'`"""
+    start_app()
+    return app
+
+@app.before_request
+def ensure_started():
+    # Servers pointed at `app:app` instead of the factory start up on their first request
+    if not started:
+        start_app()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if TRACE_LOGGING:
+        current_trace_id.set(request.headers.get('X-Request-ID') or secrets.token_hex(8))
+
+@app.after_request
+def record_request(response):
+    endpoint = request.endpoint or 'unmatched'
+    duration = time.perf_counter() - g.get('request_start', time.perf_counter())
+    metrics.inc('http_requests_total', endpoint=endpoint, status=response.status_code)
+    metrics.observe('http_request_duration_seconds', duration, endpoint=endpoint)
+    trace_id = current_trace_id.get()
+    if trace_id is not None:
+        response.headers['X-Request-ID'] = trace_id
+        app.logger.info('trace=%s %s %s status=%s duration_ms=%.1f',
+                        trace_id, request.method, request.path, response.status_code, duration * 1000)
+    return response
 
 # Authentication Routes
 @app.route('/login', methods=['GET', 'POST'])
@@ -330,11 +2760,9 @@ def login():
         if not username or not password:
             return jsonify({'success': False, 'error': 'Username and password are required'}), 400
         
-        conn = get_user_db()
-        user = conn.execute('SELECT * FROM users WHERE username = ? OR email = ?', (username, username)).fetchone()
-        conn.close()
+        user = user_store.find_login(username)
         
-        if user and check_password_hash(user['password_hash'], password):
+        if user and verify_password(user['password_hash'], password):
             session['user_id'] = user['id']
             session['username'] = user['username']
             return jsonify({'success': True, 'message': 'Login successful'})
@@ -370,33 +2798,19 @@ def signup():
         if not re.match(email_pattern, email):
             return jsonify({'success': False, 'error': 'Invalid email format'}), 400
         
-        conn = get_user_db()
         try:
-            # Check if username or email already exists
-            existing_user = conn.execute('SELECT * FROM users WHERE username = ? OR email = ?', (username, email)).fetchone()
-            if existing_user:
-                conn.close()
+            # Create new user (the insert itself detects a taken username or email)
+            password_hash = hash_password(password)
+            user_id = user_store.create_user(username, email, password_hash)
+            if user_id is None:
                 return jsonify({'success': False, 'error': 'Username or email already exists'}), 400
             
-            # Create new user
-            password_hash = generate_password_hash(password)
-            cursor = conn.cursor()
-            cursor.execute('INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
-                        (username, email, password_hash))
-            conn.commit()
-            user_id = cursor.lastrowid
-            conn.close()
-            
             # Auto-login the user after successful signup
             session['user_id'] = user_id
             session['username'] = username
             
             return jsonify({'success': True, 'message': 'Account created successfully'})
-        except sqlite3.IntegrityError:
-            conn.close()
-            return jsonify({'success': False, 'error': 'Username or email already exists'}), 400
         except Exception as e:
-            conn.close()
             return jsonify({'success': False, 'error': 'An error occurred. Please try again.'}), 500
     
     # If already logged in, redirect to home
@@ -441,7 +2855,7 @@ def generate_sql():
     try:
         data = request.json
         natural_language_query = data.get('query', '').strip()
-        schema_content = data.get('schema', '').strip()
+        schema_content = request_schema(data)
         model = data.get('model', OLLAMA_MODEL)
         
         if not natural_language_query:
@@ -450,22 +2864,136 @@ def generate_sql():
         if not schema_content:
             return jsonify({'error': 'Schema content is required'}), 400
         
+        candidates = data.get('candidates', 1)
+        if not isinstance(candidates, int) or isinstance(candidates, bool) or candidates < 1:
+            return jsonify({'error': 'candidates must be a positive integer'}), 400
+        candidates = min(candidates, GENERATION_MAX_CANDIDATES)
+        
         # Generate SQL using AI
-        generated_sql = generate_sql_with_ai(natural_language_query, schema_content, model)
+        if candidates > 1:
+            selection = generate_sql_candidates(natural_language_query, schema_content, model, candidates,
+                                                user=current_user_key())
+            generated_sql = selection['sql']
+        else:
+            generated_sql = generate_sql_with_ai(natural_language_query, schema_content, model, user=current_user_key())
         
-        return jsonify({
+        result = {
             'success': True,
             'sql': generated_sql
-        })
+        }
+        if candidates > 1:
+            result['valid'] = selection['valid']
+            result['candidate'] = selection['candidate']
+            result['candidates'] = selection['attempts']
+        if EXPLAIN_ENABLED and data.get('analyze', True):
+            result['analysis'] = analyze_query_plan(generated_sql, schema_content)
+        return jsonify(result)
+    except WorkspaceNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except SchedulerBusy as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': str(e.retry_after)}
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/generate-sql/stream', methods=['POST'])
+def generate_sql_stream():
+    """Server-sent events version of /api/generate-sql: 'token' events, then 'done' or 'error'"""
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'A JSON request body is required'}), 400
+        natural_language_query = data.get('query', '').strip()
+        model = data.get('model', OLLAMA_MODEL)
+        schema_content = request_schema(data)
+    except WorkspaceNotFound as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    
+    if not natural_language_query:
+        return jsonify({'error': 'Natural language query is required'}), 400
+    
+    if not schema_content:
+        return jsonify({'error': 'Schema content is required'}), 400
+    
+    # Reject up front while the queue is full, so clients get a real 429
+    try:
+        llm_scheduler.check_admission()
+    except SchedulerBusy as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': str(e.retry_after)}
+    user = current_user_key()
+    analyze = EXPLAIN_ENABLED and data.get('analyze', True)
+    
+    def events():
+        try:
+            for event, text in stream_sql_with_ai(natural_language_query, schema_content, model, user=user):
+                if event == 'done':
+                    payload = {'sql': text}
+                    if analyze:
+                        payload['analysis'] = analyze_query_plan(text, schema_content)
+                else:
+                    payload = {'text': text}
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+    
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/generate-sql/batch', methods=['POST'])
+def generate_sql_batch():
+    """Generate SQL for a list of questions; results are streamed as NDJSON in completion order"""
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'A JSON request body is required'}), 400
+        questions = data.get('queries', [])
+        schema_content = request_schema(data)
+        model = data.get('model', OLLAMA_MODEL)
+        workers = data.get('workers')
+    except WorkspaceNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q.strip() for q in questions):
+        return jsonify({'error': 'A non-empty list of natural language queries is required'}), 400
+    
+    if len(questions) > BATCH_MAX_QUERIES:
+        return jsonify({'error': f'At most {BATCH_MAX_QUERIES} queries are allowed per batch'}), 400
+    
+    if not schema_content:
+        return jsonify({'error': 'Schema content is required'}), 400
+    
+    try:
+        results = iter_batch_generation([q.strip() for q in questions], schema_content, model,
+                                        workers=workers if isinstance(workers, int) else None, user=current_user_key())
+        # Resolve the model before the response starts so errors get a proper status
+        first = next(results)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    def lines():
+        yield json.dumps(first) + '\n'
+        for result in results:
+            yield json.dumps(result) + '\n'
+    
+    return Response(lines(), mimetype='application/x-ndjson')
 
 @app.route('/api/execute-sql', methods=['POST'])
 def execute_sql():
+    """Run SQL against the schema.
+
+    By default SELECT results are returned as a list of row objects. With
+    `limit` they are paginated as row arrays with a `next_cursor` token to pass
+    back as `cursor`; with `stream: true` they are streamed as NDJSON. All
+    modes stop after EXECUTE_MAX_ROWS rows and report `truncated`.
+    """
     try:
         data = request.json
         sql_query = data.get('sql', '').strip()
-        schema_content = data.get('schema', '').strip()
+        schema_content = request_schema(data)
+        limit = data.get('limit')
         
         if not sql_query:
             return jsonify({'error': 'SQL query is required'}), 400
@@ -473,33 +3001,172 @@ def execute_sql():
         if not schema_content:
             return jsonify({'error': 'Schema content is required'}), 400
         
-        # Create database connection
-        conn = get_db_connection(schema_content)
+        if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit <= 0):
+            return jsonify({'error': 'limit must be a positive integer'}), 400
+        
+        cursor_token = data.get('cursor')
+        if cursor_token is not None and (not isinstance(cursor_token, str) or not re.fullmatch(r'[\w-]+:\d+', cursor_token)):
+            return jsonify({'error': 'cursor must be a next_cursor value from a previous page'}), 400
+        
+        if limit is not None:
+            return jsonify(fetch_result_page(sql_query, schema_content, limit, cursor_token))
+        
+        # Small deterministic reads that already ran on this schema are answered from the statement cache
+        statement = statement_cache.lookup(sql_query, schema_content)
+        if statement['rows'] is not None and not data.get('stream'):
+            columns = statement['columns']
+            return jsonify({
+                'success': True,
+                'columns': columns,
+                'results': [dict(zip(columns, row)) for row in statement['rows']],
+                'truncated': False
+            })
+        
+        # Create database connection (with resource limits for the query)
+        conn, guard = get_guarded_connection(schema_content, statement['read_only'])
         cursor = conn.cursor()
         
         # Execute query
-        cursor.execute(sql_query)
+        try:
+            with stage_timer('execution'):
+                cursor.execute(sql_query)
+        except sqlite3.Error as e:
+            conn.close()
+            raise guard.translate(e)
         
-        # Fetch results
-        if sql_query.strip().upper().startswith('SELECT'):
-            rows = cursor.fetchall()
+        # Fetch results (any statement that returns rows, including WITH queries and PRAGMAs)
+        if cursor.description is not None:
             columns = [description[0] for description in cursor.description]
-            results = [dict(zip(columns, row)) for row in rows]
+            if data.get('stream'):
+                return Response(stream_result_rows(conn, guard, cursor, columns), mimetype='application/x-ndjson')
+            try:
+                with stage_timer('fetch'):
+                    rows = cursor.fetchmany(EXECUTE_MAX_ROWS + 1)
+            except sqlite3.Error as e:
+                conn.close()
+                raise guard.translate(e)
+            truncated = len(rows) > EXECUTE_MAX_ROWS
+            if truncated:
+                record_query_limit('rows')
+            elif statement['read_only']:
+                statement_cache.store_result(statement, columns, rows)
+            results = [dict(zip(columns, row)) for row in rows[:EXECUTE_MAX_ROWS]]
         else:
             conn.commit()
-            results = {'message': 'Query executed successfully', 'rows_affected': cursor.rowcount}
+            results = {'message': 'Query executed successfully', 'rows_affected': rows_affected(conn, cursor)}
             columns = []
+            truncated = False
         
         conn.close()
         
         return jsonify({
             'success': True,
             'columns': columns,
-            'results': results
+            'results': results,
+            'truncated': truncated
         })
+    except WorkspaceNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except QueryLimitExceeded as e:
+        return query_limit_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/workspaces', methods=['GET', 'POST'])
+def workspaces():
+    """List the user's workspaces, or create one from an uploaded .sql file (form field `file`)"""
+    user_id = session.get('user_id')
+    if user_id is None:
+        return jsonify({'error': 'Login required'}), 401
+    
+    if request.method == 'GET':
+        with user_store.connection() as conn:
+            rows = conn.execute('SELECT id, name, size_bytes, created_at FROM workspaces WHERE user_id = ? ORDER BY id',
+                                (user_id,)).fetchall()
+        return jsonify({'success': True, 'workspaces': [dict(row) for row in rows]})
+    
+    file = request.files.get('file')
+    if file is None or not file.filename:
+        return jsonify({'error': 'A .sql file is required'}), 400
+    
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'Only .sql files are allowed'}), 400
+    
+    name = request.form.get('name', '').strip() or secure_filename(file.filename)
+    try:
+        # Uploading the same file again reuses its workspace instead of storing another copy
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: file.stream.read(1024 * 1024), b''):
+            digest.update(chunk)
+        file.stream.seek(0)
+        content_hash = digest.hexdigest()
+        existing = find_workspace(user_id, content_hash)
+        if existing is not None:
+            return jsonify({'success': True, 'workspace': existing, 'reused': True})
+        
+        with user_store.connection() as conn:
+            count = conn.execute('SELECT COUNT(*) FROM workspaces WHERE user_id = ?', (user_id,)).fetchone()[0]
+        if count >= WORKSPACE_MAX_PER_USER:
+            return jsonify({'error': f'Workspace limit reached ({WORKSPACE_MAX_PER_USER}); delete one first'}), 400
+        
+        # The upload is translated line by line as it is read, never held in memory whole
+        workspace = create_workspace(user_id, name, file.stream, content_hash)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'success': True, 'workspace': workspace}), 201
+
+@app.route('/api/workspaces/<int:workspace_id>', methods=['DELETE'])
+def delete_workspace(workspace_id):
+    try:
+        workspace = get_workspace(session.get('user_id'), workspace_id)
+    except WorkspaceNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    
+    with user_store.connection() as conn:
+        conn.execute('DELETE FROM workspaces WHERE id = ?', (workspace.id,))
+        conn.commit()
+    # Queries still running keep their open file; it's freed when they finish
+    try:
+        os.remove(workspace.path)
+    except FileNotFoundError:
+        pass
+    return jsonify({'success': True})
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    return jsonify({
+        'schema': schema_cache.stats(),
+        'generation': generation_cache.stats(),
+        'coalescing': generation_flights.stats(),
+        'statements': statement_cache.stats(),
+        'query_limits': dict(query_limit_trips)
+    })
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape target: stage latencies, request counts, Ollama token stats and cache gauges"""
+    gauges = []
+    for cache, stats in (('schema', schema_cache.stats()), ('generation', generation_cache.stats()),
+                         ('statements', statement_cache.stats())):
+        for key, value in stats.items():
+            gauges.append((f'cache_{key}', {'cache': cache}, value))
+    for key, value in llm_scheduler.stats().items():
+        gauges.append((f'scheduler_{key}', {}, value))
+    for key, value in generation_flights.stats().items():
+        gauges.append((f'coalescing_{key}', {}, value))
+    with query_limit_lock:
+        trips = dict(query_limit_trips)
+    for limit, count in trips.items():
+        gauges.append(('query_limit_trips', {'limit': limit}, count))
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/ready')
+def readiness():
+    """Readiness probe: 200 once the model and sample schemas are warm, 503 until then"""
+    warmup.start(retry_failed=True)
+    ready, tasks = warmup.status()
+    return jsonify({'ready': ready, 'tasks': tasks}), 200 if ready else 503
+
 @app.route('/api/contact', methods=['POST'])
 def contact_submit():
     try:
@@ -533,8 +3200,19 @@ def contact_submit():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.cli.command('generate-batch')
+@click.argument('schema_file', type=click.File('r'))
+@click.argument('queries_file', type=click.File('r'))
+@click.option('--model', default=OLLAMA_MODEL, help='Ollama model to use.')
+@click.option('--workers', type=int, default=None, help='Questions generated in parallel.')
+def generate_batch_command(schema_file, queries_file, model, workers):
+    """Generate SQL for each line of QUERIES_FILE against SCHEMA_FILE, printing NDJSON results."""
+    schema_content = schema_file.read().strip()
+    questions = [line.strip() for line in queries_file if line.strip()]
+    for result in iter_batch_generation(questions, schema_content, model, workers=workers, user='cli'):
+        click.echo(json.dumps(result))
+
 if __name__ == '__main__':
-    # Initialize database on startup
-    init_db()
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Initialize the database and start warming up, then serve
+    create_app().run(debug=True, host='0.0.0.0', port=5000)
 
@@ -0,0 +1,28 @@
+"""Benchmark schema materialization: per-statement loading vs. bulk loading.
+
+Usage: python benchmarks/bench_schema_load.py [rows ...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import build_schema_db
+from benchmarks.dumps import make_dump
+
+def measure(dump, bulk):
+    start = time.perf_counter()
+    build_schema_db(dump, bulk=bulk).close()
+    return time.perf_counter() - start
+
+def main(sizes):
+    print(f"{'rows':>10} {'rows/INSERT':>12} {'per-stmt s':>11} {'bulk s':>9}")
+    for rows in sizes:
+        # Extended inserts (phpMyAdmin default) and one row per INSERT (mysqldump --skip-extended-insert)
+        for rows_per_insert in (1000, 1):
+            dump = make_dump(rows, rows_per_insert=rows_per_insert)
+            print(f"{rows:>10} {rows_per_insert:>12} {measure(dump, False):>11.3f} {measure(dump, True):>9.3f}")
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000])
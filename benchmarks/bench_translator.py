@@ -0,0 +1,142 @@
+"""Benchmark the streaming MySQL->SQLite translator against the regex-based one it replaced.
+
+Usage: python benchmarks/bench_translator.py [rows ...]
+"""
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import iter_sqlite_statements
+from benchmarks.dumps import make_dump
+
+# The multi-pass translator previously used by get_db_connection(), kept verbatim as the baseline
+def legacy_convert_mysql_to_sqlite(schema_content):
+    """Convert MySQL syntax to SQLite-compatible syntax"""
+    # Remove backticks first (before other processing)
+    schema_content = schema_content.replace('`', '')
+    
+    # Remove comment lines
+    lines = schema_content.split('\n')
+    cleaned_lines = []
+    for line in lines:
+        stripped = line.strip()
+        # Skip comment lines and empty lines
+        if stripped.startswith('--') or not stripped or (stripped.startswith('/*') and stripped.endswith('*/')):
+            continue
+        cleaned_lines.append(stripped)
+    
+    # Join all lines into single string (SQL statements can be multi-line)
+    schema_content = ' '.join(cleaned_lines)
+    
+    # Find and process CREATE TABLE statements
+    # SQLite requires AUTOINCREMENT to be used with INTEGER PRIMARY KEY, not INTEGER NOT NULL AUTOINCREMENT
+    def fix_auto_increment_in_table(create_stmt):
+        """Fix AUTO_INCREMENT columns that are also PRIMARY KEY and remove MySQL-specific syntax"""
+        # Remove MySQL-specific syntax that comes after the closing parenthesis
+        # Find the last closing parenthesis and remove everything after it that matches MySQL syntax
+        last_paren = create_stmt.rfind(')')
+        if last_paren != -1:
+            table_def = create_stmt[:last_paren + 1]
+            remainder = create_stmt[last_paren + 1:]
+            # Remove MySQL-specific syntax from remainder
+            remainder = re.sub(r'\s*ENGINE\s*=\s*\w+', '', remainder, flags=re.IGNORECASE)
+            remainder = re.sub(r'\s*DEFAULT\s+CHARSET\s*=\s*\w+', '', remainder, flags=re.IGNORECASE)
+            remainder = re.sub(r'\s*CHARACTER\s+SET\s+\w+', '', remainder, flags=re.IGNORECASE)
+            remainder = re.sub(r'\s*AUTO_INCREMENT\s*=\s*\d+', '', remainder, flags=re.IGNORECASE)
+            remainder = re.sub(r'\s*COLLATE\s+\w+', '', remainder, flags=re.IGNORECASE)
+            create_stmt = table_def + remainder
+        
+        # Find column with AUTO_INCREMENT
+        # Pattern to match: column_name int(11) NOT NULL AUTO_INCREMENT or similar
+        autoinc_col_pattern = r'(\w+)\s+(?:int\(\d+\)|int\b|INTEGER)\s+(?:NOT\s+NULL\s+)?AUTO_INCREMENT'
+        match = re.search(autoinc_col_pattern, create_stmt, re.IGNORECASE)
+        
+        if match:
+            col_name = match.group(1)
+            # Check if there's a PRIMARY KEY constraint for this column
+            pk_constraint_pattern = r'PRIMARY\s+KEY\s*\(\s*' + re.escape(col_name) + r'\s*\)'
+            
+            if re.search(pk_constraint_pattern, create_stmt, re.IGNORECASE):
+                # Replace the column definition to use INTEGER PRIMARY KEY AUTOINCREMENT
+                # Match: col_name int(...) NOT NULL AUTO_INCREMENT (with variations)
+                col_def_to_replace = r'\b' + re.escape(col_name) + r'\s+(?:int\(\d+\)|int\b|INTEGER)\s+(?:NOT\s+NULL\s+)?AUTO_INCREMENT'
+                create_stmt = re.sub(col_def_to_replace, 
+                                    col_name + ' INTEGER PRIMARY KEY AUTOINCREMENT', 
+                                    create_stmt, flags=re.IGNORECASE)
+                
+                # Remove the separate PRIMARY KEY constraint
+                create_stmt = re.sub(pk_constraint_pattern + r'\s*,?\s*', '', create_stmt, flags=re.IGNORECASE)
+        
+        return create_stmt
+    
+    # Split by semicolons to process each statement separately
+    # This is simpler and more reliable than trying to match nested parentheses
+    parts = schema_content.split(';')
+    processed_parts = []
+    for part in parts:
+        part = part.strip()
+        if not part:
+            continue
+        # Check if this is a CREATE TABLE statement
+        if re.match(r'CREATE\s+TABLE', part, re.IGNORECASE):
+            part = fix_auto_increment_in_table(part)
+        processed_parts.append(part)
+    
+    schema_content = '; '.join(processed_parts)
+    
+    # Convert INT(n) to INTEGER for all remaining columns
+    schema_content = re.sub(r'\bint\(\d+\)', 'INTEGER', schema_content, flags=re.IGNORECASE)
+    schema_content = re.sub(r'\bint\b(?!EGER)', 'INTEGER', schema_content, flags=re.IGNORECASE)
+    
+    # Remove any remaining AUTO_INCREMENT (SQLite only supports AUTOINCREMENT with PRIMARY KEY)
+    schema_content = re.sub(r'\s+AUTO_INCREMENT\b', '', schema_content, flags=re.IGNORECASE)
+    
+    # Remove MySQL-specific syntax
+    schema_content = re.sub(r'\s*ENGINE\s*=\s*\w+', '', schema_content, flags=re.IGNORECASE)
+    schema_content = re.sub(r'\s*CHARACTER\s+SET\s+\w+', '', schema_content, flags=re.IGNORECASE)
+    schema_content = re.sub(r'\s*COLLATE\s+\w+', '', schema_content, flags=re.IGNORECASE)
+    schema_content = re.sub(r'\s*DEFAULT\s+CHARSET\s*=\s*\w+', '', schema_content, flags=re.IGNORECASE)
+    schema_content = re.sub(r'\bUNSIGNED\b', '', schema_content, flags=re.IGNORECASE)
+    schema_content = re.sub(r'\s*AUTO_INCREMENT\s*=\s*\d+\s*', ' ', schema_content, flags=re.IGNORECASE)
+    
+    # Clean up multiple spaces and commas
+    schema_content = re.sub(r',\s*,', ',', schema_content)  # double commas
+    schema_content = re.sub(r',\s*\)', ')', schema_content)  # trailing comma
+    schema_content = re.sub(r'\s+', ' ', schema_content)  # multiple spaces
+    
+    # Ensure semicolons separate statements properly
+    schema_content = re.sub(r'\s*;\s*', ';', schema_content)
+    
+    return schema_content
+
+def legacy_translate(dump):
+    return [s for s in legacy_convert_mysql_to_sqlite(dump).split(';') if s.strip()]
+
+def streaming_translate(dump):
+    return list(iter_sqlite_statements(dump))
+
+def measure(func, dump):
+    """Return (seconds, peak traced bytes) for one call"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(dump)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+def main(sizes):
+    print(f"{'rows':>10} {'dump MB':>8} {'legacy s':>9} {'legacy MB':>10} {'stream s':>9} {'stream MB':>10}")
+    for rows in sizes:
+        dump = make_dump(rows)
+        legacy_time, legacy_peak = measure(legacy_translate, dump)
+        stream_time, stream_peak = measure(streaming_translate, dump)
+        print(f"{rows:>10} {len(dump) / 1e6:>8.1f} {legacy_time:>9.3f} {legacy_peak / 1e6:>10.1f} "
+              f"{stream_time:>9.3f} {stream_peak / 1e6:>10.1f}")
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000])
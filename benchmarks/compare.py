@@ -0,0 +1,35 @@
+"""Compare two benchmark suite results.
+
+Usage: python benchmarks/compare.py BASELINE.json CANDIDATE.json
+"""
+import json
+import sys
+
+def load_results(path):
+    with open(path) as f:
+        report = json.load(f)
+    return {(r['stage'], json.dumps(r['params'], sort_keys=True)): r for r in report['results']}
+
+def change(old, new):
+    if not old or new is None:
+        return '     n/a'
+    return f'{(new - old) / old * 100:+7.1f}%'
+
+def main(baseline_path, candidate_path):
+    baseline = load_results(baseline_path)
+    candidate = load_results(candidate_path)
+    print(f"{'stage':<12} {'params':<60} {'p50':>8} {'p95':>8} {'p99':>8} {'thru':>8} {'rss':>8}")
+    for key, new in candidate.items():
+        old = baseline.get(key)
+        if old is None:
+            continue
+        stage, params = key
+        print(f"{stage:<12} {params[:60]:<60} "
+              + ' '.join(change(old['latency_ms'][p], new['latency_ms'][p]) for p in ('p50', 'p95', 'p99'))
+              + f" {change(old['throughput_per_sec'], new['throughput_per_sec'])}"
+              + f" {change(old['peak_rss_mb'], new['peak_rss_mb'])}")
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit(__doc__.strip())
+    main(sys.argv[1], sys.argv[2])
@@ -0,0 +1,34 @@
+"""Synthetic MySQL dumps modeled on sample_schema.sql, for benchmarking"""
+import random
+
+FIRST_NAMES = ['david', 'rogers', 'maria', 'morris', 'daniel', 'sanders', 'mark', 'morgan', 'paul', 'michael']
+LAST_NAMES = ['john', 'paul', 'sanders', 'miller', 'michael', 'brown', 'james', 'wright', 'ross', 'bell']
+
+CREATE_USER_DETAILS = """CREATE TABLE IF NOT EXISTS `user_details` (
+  `user_id` int(11) NOT NULL AUTO_INCREMENT,
+  `username` varchar(255) DEFAULT NULL,
+  `first_name` varchar(50) DEFAULT NULL,
+  `last_name` varchar(50) DEFAULT NULL,
+  `gender` varchar(10) DEFAULT NULL,
+  `password` varchar(50) DEFAULT NULL,
+  `status` tinyint(10) DEFAULT NULL,
+  PRIMARY KEY (`user_id`),
+  KEY `last_name` (`last_name`)
+) ENGINE=MyISAM  DEFAULT CHARSET=latin1 AUTO_INCREMENT=10001 ;
+"""
+
+def make_dump(rows, rows_per_insert=1000, seed=0):
+    """Return a phpMyAdmin-style dump of `user_details` with `rows` data rows"""
+    rng = random.Random(seed)
+    out = ['--\n-- Table structure for table `user_details`\n--\n\n', CREATE_USER_DETAILS, '\n']
+    for start in range(1, rows + 1, rows_per_insert):
+        out.append('INSERT INTO `user_details` (`user_id`, `username`, `first_name`, `last_name`, '
+                   '`gender`, `password`, `status`) VALUES\n')
+        values = []
+        for user_id in range(start, min(start + rows_per_insert, rows + 1)):
+            first = rng.choice(FIRST_NAMES)
+            last = rng.choice(LAST_NAMES)
+            values.append(f"({user_id}, '{last}{rng.randint(1, 99)}', '{first}', '{last}', "
+                          f"'{rng.choice(['Male', 'Female'])}', '{rng.getrandbits(128):032x}', 1)")
+        out.append(',\n'.join(values) + ';\n\n')
+    return ''.join(out)
@@ -0,0 +1,120 @@
+"""Local stand-in for the Ollama HTTP API, with configurable latency and token rate.
+
+Serves /api/tags, /api/chat and /api/generate, streaming or not, and reports
+eval_count/eval_duration like Ollama does, so the app's whole generation path
+can be benchmarked without a model.
+
+Usage: python benchmarks/fake_ollama.py [--port 11435] [--latency 0.1] [--tokens-per-sec 100]
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_SQL = 'SELECT first_name, last_name FROM user_details WHERE status = 1 ORDER BY last_name LIMIT 10;'
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, data):
+        line = json.dumps(data).encode('utf-8') + b'\n'
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path != '/api/tags':
+            return self.send_json({'error': 'not found'}, 404)
+        self.send_json({'models': [{'name': name} for name in self.server.models]})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path not in ('/api/chat', '/api/generate'):
+            return self.send_json({'error': 'not found'}, 404)
+        if body.get('model') not in self.server.models:
+            return self.send_json({'error': f"model '{body.get('model')}' not found"}, 404)
+
+        chat = self.path == '/api/chat'
+        prompt = body['messages'][-1]['content'] if chat else body.get('prompt', '')
+        tokens = self.server.tokens
+        token_delay = 1 / self.server.tokens_per_sec if self.server.tokens_per_sec else 0
+        stats = {
+            'prompt_eval_count': len(prompt) // 4,
+            'prompt_eval_duration': int(self.server.latency * 1e9),
+            'eval_count': len(tokens),
+            'eval_duration': int(len(tokens) * token_delay * 1e9)
+        }
+        text = lambda content: {'message': {'role': 'assistant', 'content': content}} if chat else {'response': content}
+
+        # Prompt processing and model load time before the first token
+        time.sleep(self.server.latency)
+        if not body.get('stream'):
+            time.sleep(len(tokens) * token_delay)
+            return self.send_json({'model': body['model'], **text(''.join(tokens)), 'done': True, **stats})
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for token in tokens:
+                time.sleep(token_delay)
+                self.send_chunk({'model': body['model'], **text(token), 'done': False})
+            self.send_chunk({'model': body['model'], **text(''), 'done': True, **stats})
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the stream early (the app stops at the first complete statement)
+            self.close_connection = True
+
+class FakeOllama(ThreadingHTTPServer):
+    """Fake Ollama server answering every generation with `sql`, wrapped in a markdown fence"""
+
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.1, tokens_per_sec=100.0, sql=DEFAULT_SQL, models=('llama3.2:3b',)):
+        super().__init__(('127.0.0.1', port), FakeOllamaHandler)
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.models = list(models)
+        # Roughly one token per word, like a real tokenizer on SQL
+        self.tokens = re.findall(r'\S+\s*', f'```sql\n{sql}\n```')
+
+    @property
+    def url(self):
+        """Value for the app's OLLAMA_API_URL"""
+        return f'http://127.0.0.1:{self.server_address[1]}/api/chat'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a fake Ollama server.')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--latency', type=float, default=0.1, help='Seconds before the first token.')
+    parser.add_argument('--tokens-per-sec', type=float, default=100.0, help='Generation speed (0 for no delay).')
+    parser.add_argument('--sql', default=DEFAULT_SQL, help='SQL returned for every question.')
+    parser.add_argument('--model', action='append', dest='models', help='Installed model name (repeatable).')
+    args = parser.parse_args()
+    server = FakeOllama(args.port, args.latency, args.tokens_per_sec, args.sql, args.models or ['llama3.2:3b'])
+    print(f'Fake Ollama listening on {server.url}')
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Concurrent HTTP load driver and latency statistics.
+
+Usage: python benchmarks/load.py URL BODY_JSON [--concurrency 4] [--requests 100]
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+
+import requests
+
+def percentile(sorted_values, p):
+    """p-th percentile (0-100) of sorted values, linearly interpolated"""
+    if not sorted_values:
+        return None
+    rank = (len(sorted_values) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+def summarize(latencies, elapsed, errors=0):
+    """Latency percentiles (ms) and throughput for one measured run"""
+    values = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        'requests': len(values) + errors,
+        'errors': errors,
+        'latency_ms': {
+            'p50': ms(percentile(values, 50)),
+            'p95': ms(percentile(values, 95)),
+            'p99': ms(percentile(values, 99)),
+            'mean': ms(sum(values) / len(values)) if values else None,
+            'max': ms(values[-1]) if values else None
+        },
+        'throughput_per_sec': round(len(values) / elapsed, 3) if elapsed else None
+    }
+
+def run_load(url, make_body, concurrency, total):
+    """POST make_body(i) to url `total` times from `concurrency` threads; returns summarize() stats.
+
+    Responses are read to the end (so streamed bodies count in full); a non-200
+    status or an `error` in a JSON body counts as an error.
+    """
+    counter = itertools.count()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        session = requests.Session()
+        while True:
+            i = next(counter)
+            if i >= total:
+                break
+            start = time.perf_counter()
+            try:
+                response = session.post(url, json=make_body(i))
+                content = response.content
+                ok = response.status_code == 200
+                if ok and response.headers.get('Content-Type', '').startswith('application/json'):
+                    ok = 'error' not in json.loads(content)
+            except requests.exceptions.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                (latencies if ok else errors).append(elapsed)
+        session.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result = summarize(latencies, time.perf_counter() - start, len(errors))
+    result['concurrency'] = concurrency
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='POST the same JSON body to a URL concurrently.')
+    parser.add_argument('url')
+    parser.add_argument('body', help='JSON request body, or @file to read it from a file.')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=100)
+    args = parser.parse_args()
+    if args.body.startswith('@'):
+        with open(args.body[1:]) as f:
+            body = json.load(f)
+    else:
+        body = json.loads(args.body)
+    print(json.dumps(run_load(args.url, lambda i: body, args.concurrency, args.requests), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""Benchmark suite for the hot paths: translation, loading, generation, execution and login.
+
+Translation and loading are timed on synthetic dumps of increasing size.
+Generation and execution drive /api/generate-sql and /api/execute-sql on a
+local server at each concurrency level, with Ollama replaced by
+benchmarks/fake_ollama.py. Login drives /login against a scratch user
+database. Every stage runs in a fresh interpreter so its
+peak RSS is its own. Results are printed as JSON (or written with --output)
+for comparing runs with benchmarks/compare.py.
+
+Usage: python benchmarks/run_suite.py [--sizes 1000 10000 100000] [--concurrency 1 4 16] [--output FILE]
+"""
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.dumps import make_dump
+from benchmarks.fake_ollama import FakeOllama
+from benchmarks.load import run_load, summarize
+
+MODEL = 'llama3.2:3b'
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def start_app_server(app):
+    from werkzeug.serving import make_server
+    # Per-request access log lines would drown the results
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+def timed_runs(func, repeat):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        run_start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - run_start)
+    return summarize(latencies, time.perf_counter() - start)
+
+def bench_translation(rows, repeat):
+    from app import iter_sqlite_statements
+    dump = make_dump(rows)
+    result = timed_runs(lambda: sum(1 for _ in iter_sqlite_statements(dump)), repeat)
+    result['dump_bytes'] = len(dump)
+    return result
+
+def bench_loading(rows, repeat):
+    from app import build_schema_db
+    dump = make_dump(rows)
+    result = timed_runs(lambda: build_schema_db(dump).close(), repeat)
+    result['dump_bytes'] = len(dump)
+    return result
+
+def bench_generation(concurrency, requests, latency, tokens_per_sec):
+    ollama = FakeOllama(latency=latency, tokens_per_sec=tokens_per_sec, models=[MODEL]).start()
+    # The app reads its configuration at import time
+    os.environ['OLLAMA_API_URL'] = ollama.url
+    os.environ['OLLAMA_MODEL'] = MODEL
+    from app import app
+    server, url = start_app_server(app)
+    schema = make_dump(100)
+    try:
+        # Distinct questions, so the generation cache never answers
+        return run_load(url + '/api/generate-sql',
+                        lambda i: {'query': f'list active users, page {i}', 'schema': schema, 'model': MODEL},
+                        concurrency, requests)
+    finally:
+        server.shutdown()
+        ollama.stop()
+
+EXECUTION_QUERIES = [
+    'SELECT count(*) FROM user_details WHERE user_id > {i}',
+    "SELECT * FROM user_details WHERE last_name = 'miller' AND user_id > {i} LIMIT 100",
+    'SELECT last_name, count(*) FROM user_details WHERE user_id > {i} GROUP BY last_name',
+    'SELECT * FROM user_details WHERE user_id > {i} ORDER BY username LIMIT 50',
+]
+
+def bench_execution(concurrency, requests, rows):
+    from app import app
+    server, url = start_app_server(app)
+    schema = make_dump(rows)
+    try:
+        # The user_id bound makes every statement new to the statement cache
+        return run_load(url + '/api/execute-sql',
+                        lambda i: {'sql': EXECUTION_QUERIES[i % len(EXECUTION_QUERIES)].format(i=i), 'schema': schema},
+                        concurrency, requests)
+    finally:
+        server.shutdown()
+
+LOGIN_USERS = 20
+
+def bench_login(concurrency, requests, hash_method):
+    database = tempfile.NamedTemporaryFile(suffix='.db', delete=False).name
+    os.environ['USER_DATABASE'] = database
+    os.environ['PASSWORD_HASH_METHOD'] = hash_method
+    import app
+    app.init_db()
+    for n in range(LOGIN_USERS):
+        app.user_store.create_user(f'user{n}', f'user{n}@example.com', app.hash_password('benchmark'))
+    server, url = start_app_server(app.app)
+    try:
+        # Alternate usernames and emails, the two lookup paths
+        return run_load(url + '/login',
+                        lambda i: {'username': f'user{i % LOGIN_USERS}' + ('@example.com' if i % 2 else ''),
+                                   'password': 'benchmark'},
+                        concurrency, requests)
+    finally:
+        server.shutdown()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(database + suffix):
+                os.remove(database + suffix)
+
+STAGES = {
+    'translation': bench_translation,
+    'loading': bench_loading,
+    'generation': bench_generation,
+    'execution': bench_execution,
+    'login': bench_login,
+}
+
+def run_stage(stage, params):
+    """Run one stage in this (fresh) process and return its result record"""
+    # Background warm-up would run alongside (and skew) the measurements
+    os.environ['WARMUP_ENABLED'] = '0'
+    rss_before = peak_rss_mb()
+    # The app creates its user database on the first request; keep it out of the checkout
+    with tempfile.TemporaryDirectory() as scratch:
+        os.environ.setdefault('USER_DATABASE', os.path.join(scratch, 'users.db'))
+        result = STAGES[stage](**params)
+    return {'stage': stage, 'params': params, **result, 'rss_before_mb': rss_before, 'peak_rss_mb': peak_rss_mb()}
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the benchmark suite and print JSON results.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='Dump sizes in rows.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per dump size for translation and loading.')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=50, help='Generation requests per concurrency level.')
+    parser.add_argument('--execute-requests', type=int, default=200, help='Execution requests per concurrency level.')
+    parser.add_argument('--execute-rows', type=int, default=10000, help='Rows in the schema queries run against.')
+    parser.add_argument('--latency', type=float, default=0.1, help='Fake Ollama seconds before the first token.')
+    parser.add_argument('--tokens-per-sec', type=float, default=100.0, help='Fake Ollama generation speed.')
+    parser.add_argument('--login-requests', type=int, default=100, help='Logins per concurrency level.')
+    parser.add_argument('--hash-method', default='scrypt', help='Password hash method (and cost) for logins.')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES))
+    parser.add_argument('--output', help='Write the JSON results to this file instead of stdout.')
+    args = parser.parse_args()
+
+    plan = []
+    for rows in args.sizes:
+        plan.append(('translation', {'rows': rows, 'repeat': args.repeat}))
+        plan.append(('loading', {'rows': rows, 'repeat': args.repeat}))
+    for concurrency in args.concurrency:
+        plan.append(('generation', {'concurrency': concurrency, 'requests': args.requests,
+                                    'latency': args.latency, 'tokens_per_sec': args.tokens_per_sec}))
+        plan.append(('execution', {'concurrency': concurrency, 'requests': args.execute_requests,
+                                   'rows': args.execute_rows}))
+        plan.append(('login', {'concurrency': concurrency, 'requests': args.login_requests,
+                               'hash_method': args.hash_method}))
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for stage, params in plan:
+        if stage not in args.stages:
+            continue
+        with context.Pool(1) as pool:
+            result = pool.apply(run_stage, (stage, params))
+        results.append(result)
+        latency = result['latency_ms']
+        print(f"{stage:<12} {json.dumps(params):<80} p50 {latency['p50']}ms p95 {latency['p95']}ms "
+              f"p99 {latency['p99']}ms {result['throughput_per_sec']}/s peak RSS {result['peak_rss_mb']}MB",
+              file=sys.stderr)
+
+    report = {
+        'meta': {
+            'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': vars(args)
+        },
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Round-trip checks for the MySQL -> SQLite dump translator."""
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import build_schema_db, iter_sqlite_statements
+
+def load(dump, bulk=True):
+    return build_schema_db(dump, bulk=bulk)
+
+def columns(conn, table):
+    quoted = '"' + table.replace('"', '""') + '"'
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({quoted})')]
+
+def rows(conn, sql):
+    return [tuple(row) for row in conn.execute(sql)]
+
+def test_reserved_word_identifiers():
+    conn = load("CREATE TABLE `orders` (`id` int(11) NOT NULL, `group` varchar(10), `desc` text, `order` int);\n"
+                "INSERT INTO `orders` (`id`, `group`, `desc`, `order`) VALUES (1, 'a', 'b', 2);")
+    assert columns(conn, 'orders') == ['id', 'group', 'desc', 'order']
+    assert rows(conn, 'SELECT "group", "desc", "order" FROM orders') == [('a', 'b', 2)]
+
+def test_column_named_key_is_not_an_index():
+    conn = load("CREATE TABLE `settings` (\n"
+                "  `id` int(11) NOT NULL AUTO_INCREMENT,\n"
+                "  `key` varchar(64) NOT NULL,\n"
+                "  `value` text,\n"
+                "  PRIMARY KEY (`id`),\n"
+                "  UNIQUE KEY `key` (`key`),\n"
+                "  KEY `value_idx` (`value`(10))\n"
+                ") ENGINE=InnoDB;\n"
+                "INSERT INTO `settings` VALUES (1, 'theme', 'dark');")
+    assert columns(conn, 'settings') == ['id', 'key', 'value']
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert 'settings_value_idx' in indexes
+    try:
+        conn.execute("INSERT INTO settings (\"key\", value) VALUES ('theme', 'light')")
+        assert False, 'UNIQUE KEY was not translated'
+    except sqlite3.IntegrityError:
+        pass
+    # AUTO_INCREMENT + PRIMARY KEY became an INTEGER PRIMARY KEY
+    conn.execute("INSERT INTO settings (\"key\") VALUES ('lang')")
+    assert conn.execute("SELECT id FROM settings WHERE \"key\" = 'lang'").fetchone()[0] == 2
+
+def test_column_type_rewrites_skip_names():
+    statements = list(iter_sqlite_statements(
+        "CREATE TABLE t (`int` int(10) unsigned, `enum` enum('a','b') COMMENT 'int; enum', c int);"))
+    assert statements == ['CREATE TABLE t ("int" INTEGER, "enum" TEXT, c INTEGER)']
+
+def test_escapes_and_delimiters_in_literals():
+    dump = ("CREATE TABLE `notes` (`id` int, `body` text);\n"
+            "INSERT INTO `notes` VALUES (1, 'it\\'s; -- not a comment'), (2, 'a\\\\b\\nc'), (3, 'say \"hi\" ''x''');\n"
+            "/* block; comment */ -- line; comment\n"
+            "# hash comment;\n"
+            "INSERT INTO `notes` VALUES (4, \"double 'quoted'\");")
+    for bulk in (True, False):
+        conn = load(dump, bulk)
+        assert rows(conn, 'SELECT body FROM notes ORDER BY id') == [
+            ("it's; -- not a comment",), ('a\\b\nc',), ('say "hi" \'x\'',), ("double 'quoted'",)]
+
+def test_identifier_escapes():
+    conn = load('CREATE TABLE `we``ird "name"` (`a b` int);\nINSERT INTO `we``ird "name"` VALUES (1);')
+    assert columns(conn, 'we`ird "name"') == ['a b']
+    assert rows(conn, 'SELECT "a b" FROM "we`ird ""name"""') == [(1,)]
+
+def test_mysql_only_statements_are_dropped():
+    statements = list(iter_sqlite_statements(
+        "SET NAMES utf8mb4;\nLOCK TABLES `t` WRITE;\nCREATE TABLE `t` (`a` int);\nUNLOCK TABLES;\nCOMMIT;"))
+    assert statements == ['CREATE TABLE "t" ("a" INTEGER)']
@@ -0,0 +1,49 @@
+"""Uploading a dump as a workspace and building prompts from it."""
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as server
+
+DUMP = ''.join(
+    f"CREATE TABLE `table_{i}` (`id` int(11) NOT NULL AUTO_INCREMENT, `label_{i}` varchar(255), "
+    f"`notes_{i}` text, PRIMARY KEY (`id`)) ENGINE=InnoDB;\n"
+    for i in range(40)) + (
+    "CREATE TABLE `customers` (`id` int(11) NOT NULL AUTO_INCREMENT, `name` varchar(100), PRIMARY KEY (`id`));\n"
+    "CREATE TABLE `orders` (\n"
+    "  `id` int(11) NOT NULL AUTO_INCREMENT,\n"
+    "  `customer_id` int(11) NOT NULL,\n"
+    "  `total` decimal(10,2),\n"
+    "  PRIMARY KEY (`id`),\n"
+    "  KEY `customer_idx` (`customer_id`),\n"
+    "  FOREIGN KEY (`customer_id`) REFERENCES `customers` (`id`)\n"
+    ") ENGINE=InnoDB;\n"
+    "INSERT INTO `orders` VALUES (1, 1, 9.99);\n")
+
+def login(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'user_store', server.UserStore(str(tmp_path / 'users.db'), 2))
+    monkeypatch.setattr(server, 'WORKSPACE_FOLDER', str(tmp_path / 'workspaces'))
+    monkeypatch.setattr(server, 'started', True)
+    server.init_db()
+    user_id = server.user_store.create_user('alice', 'alice@example.com', 'x')
+    client = server.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    return client, user_id
+
+def test_workspace_prompt_selects_relevant_tables(tmp_path, monkeypatch):
+    client, user_id = login(tmp_path, monkeypatch)
+    response = client.post('/api/workspaces', data={'file': (io.BytesIO(DUMP.encode()), 'shop.sql')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 201
+    workspace = server.get_workspace(user_id, response.get_json()['workspace']['id'])
+
+    catalog = server.SchemaCatalog.from_schema(workspace)
+    assert len(catalog.tables) == 42
+    prompt = server.build_schema_prompt('total of all orders per customer', workspace)
+    assert 'orders(' in prompt
+    assert 'FK customer_id -> customers.id' in prompt
+    assert 'customers(' in prompt
+    assert 'schema truncated' not in prompt